@@ -1,225 +1,415 @@
+import csv
+import io
 import json
-import os
-import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
+from db import get_pool, get_read_pool
+from idempotency import IdempotencyStore
+from ledger import compact, maybe_compact
+from responses import dumps, error_response, json_response, preflight_response, raw_json_response, text_response
+from statements import statements
+from timing import instrumented, note
+from tokens import claims_from_event
+
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+USERS_FETCH_CHUNK = 500
+BULK_MAX_ITEMS = 5000
+STATS_DAYS_DEFAULT = 30
+STATS_DAYS_MAX = 366
+EXPORT_MAX_ROWS = 100000
+
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_COLUMNS = ('id', 'username', 'balance', 'is_admin', 'is_banned', 'created_at')
+
+# action -> (SET clause applied from the VALUES list, expected value type);
+# coins have no SET clause because they are credited through coin_ledger
+BULK_ACTIONS = {
+    'bulk_add_coins': (None, int),
+    'bulk_ban_users': ('is_banned = v.value, token_version = u.token_version + 1', bool),
+    'bulk_grant_admin': ('is_admin = v.value, token_version = u.token_version + 1', bool)
+}
+
+idempotency = IdempotencyStore('admin')
+
+ADMIN_FLAG = statements.register('admin_flag', 'SELECT is_admin FROM users WHERE username = $1', ('varchar',))
+
+def parse_flag(value: str) -> bool:
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+def build_users_page_query(params: Dict[str, Any], default_limit: int = USERS_PAGE_DEFAULT,
+                           max_limit: int = USERS_PAGE_MAX) -> Tuple[str, List[Any], int]:
+    '''
+    Keyset page over users ordered by id: after_id is the cursor returned as
+    next_cursor by the previous page, search is a username prefix
+    '''
+    limit = int(params.get('limit') or default_limit)
+    if limit < 1 or limit > max_limit:
+        raise ValueError(limit)
+    
+    conditions = ['id > %s']
+    values: List[Any] = [int(params.get('after_id') or 0)]
+    
+    search = params.get('search')
+    if search:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append('username LIKE %s')
+        values.append(escaped + '%')
+    
+    for flag in ('is_banned', 'is_admin'):
+        if params.get(flag):
+            conditions.append(f'{flag} = %s')
+            values.append(parse_flag(params[flag]))
+    
+    values.append(limit + 1)
+    query = (
+        'SELECT id, username, balance + pending_coins(id), is_admin, is_banned, created_at FROM users '
+        'WHERE ' + ' AND '.join(conditions) + ' ORDER BY id LIMIT %s'
+    )
+    return query, values, limit
+
+def parse_bulk_items(items: Any, value_type: type) -> Dict[str, Any]:
+    '''
+    Accepts [[username, value], ...] or [{"username": ..., "value": ...}, ...];
+    repeated usernames are summed for coins and last-wins for flags
+    '''
+    if not isinstance(items, list) or not items or len(items) > BULK_MAX_ITEMS:
+        raise ValueError('items')
+    merged: Dict[str, Any] = {}
+    for item in items:
+        if isinstance(item, dict):
+            username, value = item.get('username'), item.get('value')
+        elif isinstance(item, list) and len(item) == 2:
+            username, value = item
+        else:
+            raise ValueError(item)
+        if not isinstance(username, str) or not username or type(value) is not value_type:
+            raise ValueError(item)
+        if value_type is int and username in merged:
+            merged[username] += value
+        else:
+            merged[username] = value
+    return merged
+
+def run_bulk_update(cur: Any, action: str, items: Dict[str, Any]) -> List[Tuple[Any, ...]]:
+    set_clause = BULK_ACTIONS[action][0]
+    if set_clause is None:
+        query = '''
+            WITH v(username, value) AS (VALUES %s),
+            credit AS (
+                INSERT INTO coin_ledger (user_id, delta, reason)
+                SELECT u.id, v.value, 'admin_grant' FROM users u JOIN v ON u.username = v.username
+                RETURNING user_id, delta
+            )
+            SELECT u.username, u.balance + pending_coins(u.id) + credit.delta, u.is_banned, u.is_admin
+            FROM users u JOIN credit ON u.id = credit.user_id'''
+    else:
+        query = f'''UPDATE users AS u SET {set_clause}
+            FROM (VALUES %s) AS v(username, value)
+            WHERE u.username = v.username
+            RETURNING u.username, u.balance + pending_coins(u.id), u.is_banned, u.is_admin'''
+    # psycopg2.extras pulls in uuid, ipaddress and friends; only bulk requests need it
+    from psycopg2.extras import execute_values
+    return execute_values(cur, query, list(items.items()), page_size=len(items), fetch=True)
+
+def export_users(conn: Any, query: str, values: List[Any], limit: int, fmt: str) -> Tuple[str, Optional[int]]:
+    '''
+    Encodes up to limit users as CSV or NDJSON while they arrive from a
+    server-side cursor in USERS_FETCH_CHUNK row batches, so only the output is
+    held in memory. Returns the body and the after_id of the next part, if any.
+    '''
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    
+    written = 0
+    last_id = None
+    has_more = False
+    with conn.cursor(name='admin_users_export') as export_cur:
+        export_cur.itersize = USERS_FETCH_CHUNK
+        export_cur.execute(query, values)
+        for u in export_cur:
+            if written == limit:
+                has_more = True
+                break
+            row = (u[0], u[1], u[2], u[3], u[4], str(u[5]))
+            if fmt == 'csv':
+                writer.writerow(row)
+            else:
+                out.write(dumps(dict(zip(EXPORT_COLUMNS, row))))
+                out.write('\n')
+            written += 1
+            last_id = u[0]
+    return out.getvalue(), last_id if has_more else None
+
+def load_stats(cur: Any, days: int) -> Dict[str, Any]:
+    '''
+    Reads the trigger-maintained counters (V0013): a handful of small rows per
+    metric, however many users, purchases and claims there are
+    '''
+    cur.execute("SELECT metric, sum(value) FROM stat_counters GROUP BY metric")
+    counters = {row[0]: int(row[1]) for row in cur.fetchall()}
+    
+    cur.execute("""
+        SELECT c.gift_id, g.name, c.purchases
+        FROM (SELECT gift_id, sum(purchases) AS purchases FROM gift_purchase_counts GROUP BY gift_id) c
+        LEFT JOIN gifts g ON g.id = c.gift_id
+        ORDER BY c.purchases DESC, c.gift_id
+    """)
+    purchases = [{'gift_id': r[0], 'name': r[1], 'purchases': int(r[2])} for r in cur.fetchall()]
+    
+    cur.execute("""
+        SELECT claim_date, sum(claims) FROM daily_claim_counts
+        WHERE claim_date > CURRENT_DATE - %s
+        GROUP BY claim_date ORDER BY claim_date
+    """, (days,))
+    claims = [{'date': r[0].isoformat(), 'claims': int(r[1])} for r in cur.fetchall()]
+    
+    return {
+        'users': {
+            'total': counters.get('users', 0),
+            'banned': counters.get('banned_users', 0),
+            'admins': counters.get('admin_users', 0)
+        },
+        'coins_in_circulation': counters.get('coins', 0),
+        'purchases_per_gift': purchases,
+        'daily_claims': claims
+    }
+
+def check_admin(event: Dict[str, Any], cur: Any, admin_username: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''
+    Authorizes from the session token claims without touching the database.
+    Requests without a valid token fall back to looking up admin_username, a
+    compatibility path for clients that do not refresh their token yet; each
+    use is noted as admin_auth=username in the timing log line
+    '''
+    claims = claims_from_event(event)
+    if claims:
+        is_admin = claims.get('adm') and not claims.get('ban')
+    elif admin_username:
+        note('admin_auth', 'username')
+        statements.execute(cur, ADMIN_FLAG, (admin_username,))
+        admin_check = cur.fetchone()
+        is_admin = admin_check and admin_check[0]
+    else:
+        return error_response(400, 'Admin username required')
+    
+    if not is_admin:
+        return error_response(403, 'Access denied')
+    return None
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Admin panel operations - manage users, add coins, ban users, grant admin rights
-    Args: event with httpMethod, body with action, admin_username, target_username, coins
+    Args: event with httpMethod, query with admin_username, limit, after_id, search, is_banned, is_admin
+          (or action stats with days, or action export with format csv/ndjson and the listing filters);
+          body with action, admin_username, target_username, coins (Idempotency-Key header for add_coins)
+          (bulk_add_coins, bulk_ban_users, bulk_grant_admin take items: [[username, value], ...];
+          compact_ledger folds pending coin credits into balances)
     Returns: HTTP response with operation result
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight_response()
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    pool = get_read_pool() if method == 'GET' else get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
         if method == 'GET':
-            params = event.get('queryStringParameters', {})
-            admin_username = params.get('admin_username')
+            params = event.get('queryStringParameters') or {}
+            admin_error = check_admin(event, cur, params.get('admin_username'))
+            if admin_error:
+                return admin_error
             
-            if not admin_username:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Admin username required'})
-                }
+            if params.get('action') == 'stats':
+                try:
+                    days = int(params.get('days') or STATS_DAYS_DEFAULT)
+                except ValueError:
+                    days = 0
+                if days < 1 or days > STATS_DAYS_MAX:
+                    return error_response(400, f'days must be 1-{STATS_DAYS_MAX}')
+                return json_response(200, load_stats(cur, days))
             
-            cur.execute("SELECT is_admin FROM users WHERE username = %s", (admin_username,))
-            admin_check = cur.fetchone()
+            if params.get('action') == 'export':
+                fmt = params.get('format', 'csv')
+                if fmt not in EXPORT_FORMATS:
+                    return error_response(400, f'format must be one of {", ".join(EXPORT_FORMATS)}')
+                try:
+                    query, values, limit = build_users_page_query(params, EXPORT_MAX_ROWS, EXPORT_MAX_ROWS)
+                except ValueError:
+                    return error_response(400, 'Invalid parameters')
+                
+                body, next_cursor = export_users(conn, query, values, limit, fmt)
+                headers = {'Content-Disposition': f'attachment; filename="users.{fmt}"'}
+                if next_cursor is not None:
+                    headers['X-Next-Cursor'] = str(next_cursor)
+                    headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+                return text_response(200, body, EXPORT_FORMATS[fmt], headers)
             
-            if not admin_check or not admin_check[0]:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Access denied'})
-                }
+            try:
+                query, values, limit = build_users_page_query(params)
+            except ValueError:
+                return error_response(400, 'Invalid parameters')
             
-            cur.execute("SELECT id, username, password, balance, is_admin, is_banned, created_at FROM users ORDER BY id")
-            users = cur.fetchall()
+            rows = []
+            last_id = None
+            has_more = False
+            with conn.cursor(name='admin_users_page') as page_cur:
+                page_cur.itersize = USERS_FETCH_CHUNK
+                page_cur.execute(query, values)
+                for u in page_cur:
+                    if len(rows) == limit:
+                        has_more = True
+                        break
+                    last_id = u[0]
+                    rows.append(dumps({
+                        'id': u[0],
+                        'username': u[1],
+                        'balance': u[2],
+                        'is_admin': u[3],
+                        'is_banned': u[4],
+                        'created_at': str(u[5])
+                    }))
             
-            users_list = [{
-                'id': u[0],
-                'username': u[1],
-                'password': u[2],
-                'balance': u[3],
-                'is_admin': u[4],
-                'is_banned': u[5],
-                'created_at': str(u[6])
-            } for u in users]
+            next_cursor = last_id if has_more else None
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'users': users_list})
-            }
+            return raw_json_response(200, '{"users":[' + ','.join(rows) + '],"next_cursor":' + dumps(next_cursor) + '}')
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
-            admin_username = body_data.get('admin_username')
             target_username = body_data.get('target_username')
             
-            if not admin_username:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Admin username required'})
-                }
+            admin_error = check_admin(event, cur, body_data.get('admin_username'))
+            if admin_error:
+                return admin_error
             
-            cur.execute("SELECT is_admin FROM users WHERE username = %s", (admin_username,))
-            admin_check = cur.fetchone()
-            
-            if not admin_check or not admin_check[0]:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Access denied'})
-                }
+            if action in BULK_ACTIONS:
+                try:
+                    items = parse_bulk_items(body_data.get('items'), BULK_ACTIONS[action][1])
+                except ValueError:
+                    return error_response(400, f'items must be 1-{BULK_MAX_ITEMS} (username, value) pairs')
+                
+                rows = run_bulk_update(cur, action, items)
+                conn.commit()
+                if BULK_ACTIONS[action][0] is None:
+                    maybe_compact(conn, cur)
+                
+                updated = [{
+                    'username': r[0],
+                    'balance': r[1],
+                    'is_banned': r[2],
+                    'is_admin': r[3]
+                } for r in rows]
+                found = {r[0] for r in rows}
+                
+                return json_response(200, {
+                    'success': True,
+                    'updated': updated,
+                    'missing': [username for username in items if username not in found]
+                })
             
-            if action == 'add_coins':
+            elif action == 'add_coins':
                 coins = body_data.get('coins', 0)
                 
                 if not target_username or not isinstance(coins, int):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Invalid parameters'})
-                    }
+                    return error_response(400, 'Invalid parameters')
                 
-                cur.execute(
-                    "UPDATE users SET balance = balance + %s WHERE username = %s RETURNING balance",
-                    (coins, target_username)
-                )
+                idempotency_key, request_fingerprint, replay = idempotency.begin(event)
+                if idempotency_key and not replay:
+                    replay = idempotency.claim(cur, idempotency_key, request_fingerprint)
+                if replay:
+                    return replay
+                
+                cur.execute("""
+                    WITH credit AS (
+                        INSERT INTO coin_ledger (user_id, delta, reason)
+                        SELECT id, %s, 'admin_grant' FROM users WHERE username = %s
+                        RETURNING user_id, delta
+                    )
+                    SELECT u.balance + pending_coins(u.id) + credit.delta FROM users u JOIN credit ON u.id = credit.user_id
+                """, (coins, target_username))
                 result = cur.fetchone()
-                conn.commit()
                 
                 if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'message': f'Added {coins} coins to {target_username}',
-                        'new_balance': result[0]
-                    })
-                }
+                    conn.rollback()
+                    return error_response(404, 'User not found')
+                
+                response = idempotency.commit(conn, cur, idempotency_key, request_fingerprint, json_response(200, {
+                    'success': True,
+                    'message': f'Added {coins} coins to {target_username}',
+                    'new_balance': result[0]
+                }))
+                maybe_compact(conn, cur)
+                return response
+            
+            elif action == 'compact_ledger':
+                entries, users = compact(cur)
+                conn.commit()
+                
+                return json_response(200, {
+                    'success': True,
+                    'compacted_entries': entries,
+                    'compacted_users': users
+                })
             
             elif action == 'ban_user':
                 ban_status = body_data.get('ban', True)
                 
                 if not target_username:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Target username required'})
-                    }
+                    return error_response(400, 'Target username required')
                 
                 cur.execute(
-                    "UPDATE users SET is_banned = %s WHERE username = %s RETURNING username",
+                    "UPDATE users SET is_banned = %s, token_version = token_version + 1 WHERE username = %s RETURNING username",
                     (ban_status, target_username)
                 )
                 result = cur.fetchone()
                 conn.commit()
                 
                 if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'message': f'User {target_username} {"banned" if ban_status else "unbanned"}'
-                    })
-                }
+                    return error_response(404, 'User not found')
+                
+                return json_response(200, {
+                    'success': True,
+                    'message': f'User {target_username} {"banned" if ban_status else "unbanned"}'
+                })
             
             elif action == 'grant_admin':
                 admin_status = body_data.get('grant', True)
                 
                 if not target_username:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Target username required'})
-                    }
+                    return error_response(400, 'Target username required')
                 
                 cur.execute(
-                    "UPDATE users SET is_admin = %s WHERE username = %s RETURNING username",
+                    "UPDATE users SET is_admin = %s, token_version = token_version + 1 WHERE username = %s RETURNING username",
                     (admin_status, target_username)
                 )
                 result = cur.fetchone()
                 conn.commit()
                 
                 if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'message': f'Admin rights {"granted to" if admin_status else "revoked from"} {target_username}'
-                    })
-                }
+                    return error_response(404, 'User not found')
+                
+                return json_response(200, {
+                    'success': True,
+                    'message': f'Admin rights {"granted to" if admin_status else "revoked from"} {target_username}'
+                })
             
             else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Invalid action'})
-                }
+                return error_response(400, 'Invalid action')
         
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+            return error_response(405, 'Method not allowed')
     
     finally:
         cur.close()
-        conn.close()
+        pool.putconn(conn)
@@ -1,132 +1,149 @@
 import json
-import os
-import bcrypt
 import psycopg2
 from typing import Dict, Any
 
+from db import get_pool
+from passwords import hash_password, verify_password
+from responses import error_response, json_response, preflight_response
+from statements import statements
+from throttle import login_throttle, source_ip
+from timing import instrumented, note, phase
+from tokens import TOKEN_REFRESH_WINDOW_SECONDS, issue_token, token_from_event, verify_token
+
+LOGIN_USER = statements.register(
+    'auth_login_user',
+    'SELECT id, username, password, balance + pending_coins(id), is_banned, is_admin, token_version '
+    'FROM users WHERE username = $1',
+    ('varchar',)
+)
+REFRESH_USER = statements.register(
+    'auth_refresh_user',
+    'SELECT id, username, is_admin, is_banned, token_version FROM users WHERE id = $1',
+    ('integer',)
+)
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: User authentication and registration system
-    Args: event with httpMethod (POST), body with action, username, password
-    Returns: HTTP response with user data or error
+    Args: event with httpMethod (POST), body with action, username, password (or token for refresh)
+    Returns: HTTP response with user data and a signed session token, or error
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight_response()
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return error_response(405, 'Method not allowed')
     
     body_data = json.loads(event.get('body', '{}'))
     action = body_data.get('action')
     username = body_data.get('username', '').strip()
     password = body_data.get('password', '')
     
-    if not username or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Username and password required'})
-        }
+    if action != 'refresh' and (not username or not password):
+        return error_response(400, 'Username and password required')
+    
+    if action in ('login', 'register'):
+        limited = login_throttle.check(source_ip(event), username if action == 'login' else None)
+        note('throttle', login_throttle.stats())
+        if limited:
+            note('throttled', limited['limit'])
+            return json_response(
+                429,
+                {'error': 'Too many attempts, try again later'},
+                {'Retry-After': str(limited['retry_after'])}
+            )
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    pool = get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
         if action == 'register':
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            with phase('hash'):
+                password_hash = hash_password(password)
             
-            cur.execute(
-                "INSERT INTO users (username, password, balance) VALUES (%s, %s, 1000) RETURNING id, username, balance",
-                (username, password_hash)
-            )
+            cur.execute("""
+                WITH new_user AS (
+                    INSERT INTO users (username, password, balance) VALUES (%s, %s, 1000)
+                    RETURNING id, username, balance
+                ),
+                entry AS (
+                    INSERT INTO coin_ledger (user_id, delta, reason, compacted)
+                    SELECT id, balance, 'opening_balance', TRUE FROM new_user
+                )
+                SELECT id, username, balance FROM new_user
+            """, (username, password_hash))
             user = cur.fetchone()
             conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'balance': user[2]
-                    }
-                })
-            }
+            return json_response(200, {
+                'success': True,
+                'user': {
+                    'id': user[0],
+                    'username': user[1],
+                    'balance': user[2]
+                },
+                'token': issue_token(user[0], user[1], False, False, 0)
+            })
         
         elif action == 'login':
-            cur.execute(
-                "SELECT id, username, password, balance, is_banned FROM users WHERE username = %s",
-                (username,)
-            )
+            statements.execute(cur, LOGIN_USER, (username,))
             user = cur.fetchone()
             
-            if not user or not bcrypt.checkpw(password.encode('utf-8'), user[2].encode('utf-8')):
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Invalid credentials'})
-                }
+            with phase('hash'):
+                password_ok, new_hash = verify_password(password, user[2]) if user else (False, None)
+            
+            if not password_ok:
+                return error_response(401, 'Invalid credentials')
             
             if user[4]:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'User is banned'})
-                }
+                return error_response(403, 'User is banned')
+            
+            if new_hash:
+                cur.execute("UPDATE users SET password = %s WHERE id = %s", (new_hash, user[0]))
+                conn.commit()
+            
+            return json_response(200, {
+                'success': True,
+                'user': {
+                    'id': user[0],
+                    'username': user[1],
+                    'balance': user[3]
+                },
+                'token': issue_token(user[0], user[1], user[5], user[4], user[6])
+            })
+        
+        elif action == 'refresh':
+            token = body_data.get('token') or token_from_event(event)
+            claims = verify_token(token, leeway=TOKEN_REFRESH_WINDOW_SECONDS) if token else None
+            
+            if not claims:
+                return error_response(401, 'Invalid token')
+            
+            statements.execute(cur, REFRESH_USER, (claims['uid'],))
+            user = cur.fetchone()
+            
+            if not user or user[4] != claims['ver']:
+                return error_response(401, 'Token revoked')
+            
+            if user[3]:
+                return error_response(403, 'User is banned')
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'balance': user[3]
-                    }
-                })
-            }
+            return json_response(200, {
+                'success': True,
+                'token': issue_token(user[0], user[1], user[2], user[3], user[4])
+            })
         
         else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Invalid action'})
-            }
+            return error_response(400, 'Invalid action')
     
     except psycopg2.IntegrityError:
         conn.rollback()
-        return {
-            'statusCode': 409,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Username already exists'})
-        }
+        return error_response(409, 'Username already exists')
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        pool.putconn(conn)
\ No newline at end of file
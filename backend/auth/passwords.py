@@ -0,0 +1,88 @@
+'''
+Password hashing with a configurable bcrypt work factor. BCRYPT_ROUNDS pins the
+cost; otherwise the first hash calibrates the cost so that one hash takes about
+BCRYPT_TARGET_MS on this instance. After a successful login a stored hash is
+re-hashed when its cost differs from the pinned one, falls outside
+BCRYPT_MIN_ROUNDS..BCRYPT_MAX_ROUNDS, or is BCRYPT_REHASH_MARGIN or more away
+from the calibrated one, so instances that calibrate one round apart do not
+keep re-hashing the same user back and forth. bcrypt itself is imported on the
+first hash or check, so refresh requests and cold starts do not pay for it.
+'''
+import math
+import os
+import statistics
+import threading
+import time
+from typing import Optional, Tuple
+
+BCRYPT_MIN_ROUNDS = int(os.environ.get('BCRYPT_MIN_ROUNDS', '10'))
+BCRYPT_MAX_ROUNDS = int(os.environ.get('BCRYPT_MAX_ROUNDS', '14'))
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', '250'))
+BCRYPT_CALIBRATION_SAMPLES = int(os.environ.get('BCRYPT_CALIBRATION_SAMPLES', '5'))
+BCRYPT_REHASH_MARGIN = int(os.environ.get('BCRYPT_REHASH_MARGIN', '2'))
+CALIBRATION_ROUNDS = 8
+
+_pinned = bool(os.environ.get('BCRYPT_ROUNDS'))
+_rounds: Optional[int] = int(os.environ['BCRYPT_ROUNDS']) if _pinned else None
+_rounds_lock = threading.Lock()
+
+
+def calibrate(target_ms: float = BCRYPT_TARGET_MS, samples: int = BCRYPT_CALIBRATION_SAMPLES) -> int:
+    '''
+    Picks the highest cost whose hash time stays within target_ms. bcrypt time
+    doubles with each extra round, so hashes at a cheap cost are enough to
+    extrapolate; the median of several samples keeps one noisy measurement
+    from moving the cost.
+    '''
+    import bcrypt
+    salt = bcrypt.gensalt(CALIBRATION_ROUNDS)
+    timings = []
+    for _ in range(max(1, samples)):
+        started = time.perf_counter()
+        bcrypt.hashpw(b'calibration', salt)
+        timings.append(time.perf_counter() - started)
+    sample_ms = max(statistics.median(timings) * 1000, 0.001)
+    rounds = CALIBRATION_ROUNDS + math.floor(math.log2(target_ms / sample_ms))
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+
+
+def current_rounds() -> int:
+    global _rounds
+    if _rounds is None:
+        with _rounds_lock:
+            if _rounds is None:
+                _rounds = calibrate()
+    return _rounds
+
+
+def hash_rounds(stored_hash: str) -> Optional[int]:
+    parts = stored_hash.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def needs_rehash(stored_rounds: Optional[int]) -> bool:
+    if stored_rounds is None or not BCRYPT_MIN_ROUNDS <= stored_rounds <= BCRYPT_MAX_ROUNDS:
+        return True
+    if _pinned:
+        return stored_rounds != current_rounds()
+    return abs(stored_rounds - current_rounds()) >= BCRYPT_REHASH_MARGIN
+
+
+def hash_password(password: str) -> str:
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(current_rounds())).decode('utf-8')
+
+
+def verify_password(password: str, stored_hash: str) -> Tuple[bool, Optional[str]]:
+    '''
+    Returns whether the password matches and, when it does and the stored
+    cost needs_rehash(), a replacement hash to store
+    '''
+    import bcrypt
+    if not bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8')):
+        return False, None
+    if not needs_rehash(hash_rounds(stored_hash)):
+        return True, None
+    return True, hash_password(password)
@@ -0,0 +1,97 @@
+'''
+Shared HTTP response helpers. The JSON and CORS preflight header maps are
+built once at import as read-only mappings; every response gets its own plain
+dict copied from them, so the platform and any middleware can copy, pickle or
+modify it. JSON bodies go through dumps(), which uses orjson when it is
+installed and the stdlib otherwise (JSON_ENCODER=stdlib forces the fallback).
+'''
+import json
+import os
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from timing import phase
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _select_encoder() -> Callable[[Any], str]:
+    if os.environ.get('JSON_ENCODER', 'auto') != 'stdlib':
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            return lambda obj: orjson.dumps(obj).decode('utf-8')
+    return _stdlib_dumps
+
+
+dumps = _select_encoder()
+
+CORS_ALLOW_HEADERS = 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key'
+
+JSON_HEADERS = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+})
+
+PREFLIGHT_HEADERS = MappingProxyType({
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': CORS_ALLOW_HEADERS,
+    'Access-Control-Max-Age': '86400'
+})
+
+
+def preflight_response() -> Dict[str, Any]:
+    return {'statusCode': 200, 'headers': dict(PREFLIGHT_HEADERS), 'body': ''}
+
+
+def _headers(extra: Optional[Mapping[str, str]]) -> Dict[str, str]:
+    return {**JSON_HEADERS, **extra} if extra else dict(JSON_HEADERS)
+
+
+def raw_json_response(status: int, body: str, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Response with an already serialized JSON body
+    '''
+    return {
+        'statusCode': status,
+        'headers': _headers(headers),
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+
+def json_response(status: int, payload: Any, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    with phase('serialize'):
+        body = dumps(payload)
+    return raw_json_response(status, body, headers)
+
+
+def error_response(status: int, message: str) -> Dict[str, Any]:
+    return json_response(status, {'error': message})
+
+
+def text_response(status: int, body: str, content_type: str,
+                  headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Response with a non-JSON text body such as CSV or NDJSON
+    '''
+    return {
+        'statusCode': status,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': content_type, **(headers or {})},
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+
+def empty_response(status: int, headers: Mapping[str, str]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Access-Control-Allow-Origin': '*', **headers},
+        'isBase64Encoded': False,
+        'body': ''
+    }
@@ -0,0 +1,106 @@
+'''
+In-process token-bucket throttling of login and register attempts per source
+IP and per username. Buckets live in an LRU map capped at THROTTLE_MAX_KEYS,
+so memory stays bounded under credential-stuffing bursts with many keys.
+'''
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', '1').lower() not in ('0', 'false', 'no', '')
+THROTTLE_MAX_KEYS = int(os.environ.get('THROTTLE_MAX_KEYS', '10000'))
+THROTTLE_IP_BURST = float(os.environ.get('THROTTLE_IP_BURST', '20'))
+THROTTLE_IP_PER_SECOND = float(os.environ.get('THROTTLE_IP_PER_SECOND', '1'))
+THROTTLE_USERNAME_BURST = float(os.environ.get('THROTTLE_USERNAME_BURST', '5'))
+THROTTLE_USERNAME_PER_SECOND = float(os.environ.get('THROTTLE_USERNAME_PER_SECOND', '0.1'))
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: float, refill_per_second: float, max_keys: int = THROTTLE_MAX_KEYS):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+        self.evicted = 0
+
+    def acquire(self, key: str) -> float:
+        '''
+        Takes one token for key. Returns 0 when allowed, otherwise the number
+        of seconds until a token becomes available.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.capacity
+            else:
+                tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+                self._buckets.move_to_end(key)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.refill_per_second
+                self.throttled += 1
+
+            self._buckets[key] = [tokens, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        return wait
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'throttled': self.throttled,
+                'evicted': self.evicted,
+                'keys': len(self._buckets)
+            }
+
+
+class LoginThrottle:
+    def __init__(self):
+        self.by_ip = TokenBucketLimiter(THROTTLE_IP_BURST, THROTTLE_IP_PER_SECOND)
+        self.by_username = TokenBucketLimiter(THROTTLE_USERNAME_BURST, THROTTLE_USERNAME_PER_SECOND)
+
+    def check(self, source_ip: Optional[str], username: Optional[str]) -> Optional[Dict[str, Any]]:
+        '''
+        Returns None when the attempt may proceed, otherwise which limit was
+        hit and the Retry-After seconds
+        '''
+        if not THROTTLE_ENABLED:
+            return None
+        if source_ip:
+            wait = self.by_ip.acquire(source_ip)
+            if wait:
+                return {'limit': 'ip', 'retry_after': math.ceil(wait)}
+        if username:
+            wait = self.by_username.acquire(username.lower())
+            if wait:
+                return {'limit': 'username', 'retry_after': math.ceil(wait)}
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {'ip': self.by_ip.stats(), 'username': self.by_username.stats()}
+
+
+def source_ip(event: Dict[str, Any]) -> Optional[str]:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'x-forwarded-for' and value:
+            return value.split(',')[0].strip()
+    return None
+
+
+login_throttle = LoginThrottle()
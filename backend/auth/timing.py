@@ -0,0 +1,165 @@
+'''
+Per-request timing instrumentation. The @instrumented decorator collects
+phase timers (pool checkout, connect, queries, hashing, serialization), the
+query count of one invocation and how long into it the first query finished,
+adds a Server-Timing header to the response and prints one JSON log line.
+With TIMING_ENABLED=0 the decorator returns the handler unchanged and phase()
+is a shared no-op.
+'''
+import functools
+import json
+import os
+import sys
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2.extensions
+
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', '1').lower() not in ('0', 'false', 'no', '')
+TIMING_LOG_QUERIES = 50
+
+
+class RequestTimings:
+    __slots__ = ('started', 'first_query', 'phases', 'queries', 'query_log', 'notes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_query: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.queries = 0
+        self.query_log: List[Dict[str, Any]] = []
+        self.notes: Dict[str, Any] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, sql: Any, seconds: float) -> None:
+        if self.first_query is None:
+            self.first_query = time.perf_counter() - self.started
+        self.queries += 1
+        self.add('db', seconds)
+        if len(self.query_log) < TIMING_LOG_QUERIES:
+            text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+            self.query_log.append({'ms': round(seconds * 1000, 3), 'sql': ' '.join(text.split())[:80]})
+
+    def server_timing(self, total: float) -> str:
+        parts = []
+        for name, seconds in self.phases.items():
+            metric = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'db':
+                metric += f';desc="{self.queries} queries"'
+            parts.append(metric)
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.timings.add(self.name, time.perf_counter() - self.started)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name: str) -> Any:
+    timings = _current.get()
+    return _NO_PHASE if timings is None else _Phase(timings, name)
+
+
+def note(key: str, value: Any) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.notes[key] = value
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''
+    Cursor that reports every statement to the active request's timings
+    '''
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        timings = _current.get()
+        if timings is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            timings.add_query(query, time.perf_counter() - started)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        timings = _current.get()
+        if timings is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            timings.add_query(query, time.perf_counter() - started)
+
+
+def _log(event: Dict[str, Any], context: Any, handler: Callable[..., Any], status: Optional[int],
+         total: float, timings: RequestTimings) -> None:
+    record = {
+        'type': 'timing',
+        'function': getattr(context, 'function_name', None) or handler.__module__,
+        'request_id': getattr(context, 'request_id', None),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total * 1000, 3),
+        'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.phases.items()},
+        'queries': timings.queries,
+        'first_query_ms': round(timings.first_query * 1000, 3) if timings.first_query is not None else None,
+        'query_log': timings.query_log,
+        **timings.notes
+    }
+    print(json.dumps(record, default=str), file=sys.stdout, flush=True)
+
+
+def instrumented(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    if not TIMING_ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = timings.started
+        try:
+            response = handler(event, context)
+        except BaseException:
+            _current.reset(token)
+            _log(event, context, handler, 500, time.perf_counter() - started, timings)
+            raise
+        total = time.perf_counter() - started
+        _current.reset(token)
+        _log(event, context, handler, response.get('statusCode'), total, timings)
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = timings.server_timing(total)
+        headers['Timing-Allow-Origin'] = '*'
+        return {**response, 'headers': headers}
+
+    return wrapper
@@ -0,0 +1,46 @@
+'''
+In-process set of user ids that already claimed today's reward. Their status
+cannot change before midnight, so status checks for them skip the database.
+The set is dropped when the date changes.
+'''
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Set
+
+CLAIMED_CACHE_MAX_SIZE = int(os.environ.get('CLAIMED_CACHE_MAX_SIZE', '200000'))
+
+
+class ClaimedTodayCache:
+    def __init__(self, max_size: int = CLAIMED_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._user_ids: Set[int] = set()
+
+    def _roll(self, today: date) -> None:
+        if self._day != today:
+            self._day = today
+            self._user_ids = set()
+
+    def known(self, today: date, user_ids: Iterable[int]) -> Set[int]:
+        with self._lock:
+            self._roll(today)
+            return {u for u in user_ids if u in self._user_ids}
+
+    def add(self, today: date, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._roll(today)
+            for user_id in user_ids:
+                if len(self._user_ids) >= self.max_size:
+                    break
+                self._user_ids.add(user_id)
+
+
+def seconds_until_midnight(now: Optional[datetime] = None) -> int:
+    now = now or datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(1, int((midnight - now).total_seconds()))
+
+
+claimed_today = ClaimedTodayCache()
@@ -1,136 +1,165 @@
 import json
-import os
-import psycopg2
 from datetime import date
-from typing import Dict, Any
+from typing import Dict, Any, List, Set
 
+from claims_cache import claimed_today, seconds_until_midnight
+from db import get_pool, get_read_pool
+from idempotency import IdempotencyStore
+from ledger import maybe_compact
+from responses import error_response, json_response, preflight_response
+from statements import statements
+from timing import instrumented
+
+REWARD_AMOUNT = 100
+STATUS_BATCH_MAX = 500
+
+# Claim and credit in one round trip. ON CONFLICT ... WHERE is re-checked
+# against the latest row version, so parallel claims for the same user
+# serialize on the daily_rewards row and at most one of them pays out per day.
+# The reward is appended to coin_ledger as a pending credit instead of
+# updating the users row; the inserted entry is not visible to the rest of the
+# statement, hence the explicit + reward in the new balance.
+CLAIM_SQL = '''
+    WITH claim AS (
+        INSERT INTO daily_rewards (user_id, last_claim_date)
+        SELECT id, $2 FROM users WHERE id = $1
+        ON CONFLICT (user_id) DO UPDATE SET last_claim_date = EXCLUDED.last_claim_date
+        WHERE daily_rewards.last_claim_date < EXCLUDED.last_claim_date
+        RETURNING user_id
+    ),
+    credit AS (
+        INSERT INTO coin_ledger (user_id, delta, reason)
+        SELECT user_id, $3, 'daily_reward' FROM claim
+        RETURNING user_id
+    )
+    SELECT
+        (SELECT u.balance + pending_coins(u.id) + $3 FROM users u JOIN credit ON u.id = credit.user_id),
+        EXISTS (SELECT 1 FROM users WHERE id = $1)
+'''
+
+CLAIM = statements.register('daily_claim', CLAIM_SQL, ('integer', 'date', 'integer'))
+CLAIMED_STATUS = statements.register(
+    'daily_claimed_status',
+    'SELECT user_id FROM daily_rewards WHERE user_id = ANY($1) AND last_claim_date >= $2',
+    ('integer[]', 'date')
+)
+
+idempotency = IdempotencyStore('daily-reward')
+
+def load_claimed(user_ids: List[int], today: date) -> Set[int]:
+    '''
+    Returns which of user_ids already claimed today, in one query, and
+    remembers them until midnight
+    '''
+    pool = get_read_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            statements.execute(cur, CLAIMED_STATUS, (user_ids, today))
+            claimed = {row[0] for row in cur.fetchall()}
+    finally:
+        pool.putconn(conn)
+    claimed_today.add(today, claimed)
+    return claimed
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Daily rewards system - claim daily coins bonus
-    Args: event with httpMethod (GET/POST), body with user_id
+    Args: event with httpMethod (GET/POST), Idempotency-Key header, query with user_id or comma-separated user_ids, body with user_id
     Returns: HTTP response with reward status or claim result
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
+        return preflight_response()
+    
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        batch = 'user_ids' in params
+        raw_ids = params.get('user_ids') if batch else params.get('user_id')
+        
+        if not raw_ids:
+            return error_response(400, 'user_id required')
+        
+        try:
+            user_ids = list(dict.fromkeys(int(u) for u in raw_ids.split(',')))
+        except ValueError:
+            return error_response(400, 'user_id must be an integer')
+        
+        if len(user_ids) > STATUS_BATCH_MAX:
+            return error_response(400, f'At most {STATUS_BATCH_MAX} user_ids per request')
+        
+        today = date.today()
+        claimed = claimed_today.known(today, user_ids)
+        misses = [u for u in user_ids if u not in claimed]
+        if misses:
+            claimed |= load_claimed(misses, today)
+        
+        all_claimed = len(claimed) == len(user_ids)
+        cache_control = {
+            'Cache-Control': f'private, max-age={seconds_until_midnight()}' if all_claimed else 'private, no-cache'
         }
+        
+        if batch:
+            return json_response(200, {
+                'statuses': [{'user_id': u, 'can_claim': u not in claimed} for u in user_ids],
+                'reward_amount': REWARD_AMOUNT
+            }, cache_control)
+        
+        return json_response(200, {
+            'can_claim': not all_claimed,
+            'reward_amount': REWARD_AMOUNT
+        }, cache_control)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    idempotency_key, request_fingerprint, replay = idempotency.begin(event) if method == 'POST' else (None, '', None)
+    if replay:
+        return replay
+    
+    pool = get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters', {})
-            user_id = params.get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'user_id required'})
-                }
-            
-            today = date.today()
-            cur.execute(
-                "SELECT last_claim_date FROM daily_rewards WHERE user_id = %s",
-                (user_id,)
-            )
-            row = cur.fetchone()
-            
-            can_claim = True
-            if row:
-                last_claim = row[0]
-                if last_claim >= today:
-                    can_claim = False
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'can_claim': can_claim,
-                    'reward_amount': 100
-                })
-            }
-        
-        elif method == 'POST':
+        if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             user_id = body_data.get('user_id')
             
             if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'user_id required'})
-                }
-            
-            today = date.today()
+                return error_response(400, 'user_id required')
             
-            cur.execute(
-                "SELECT last_claim_date FROM daily_rewards WHERE user_id = %s",
-                (user_id,)
-            )
-            row = cur.fetchone()
+            if idempotency_key:
+                replay = idempotency.claim(cur, idempotency_key, request_fingerprint)
+                if replay:
+                    return replay
             
-            if row and row[0] >= today:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Already claimed today'})
-                }
-            
-            reward_amount = 100
-            
-            cur.execute(
-                "UPDATE users SET balance = balance + %s WHERE id = %s RETURNING balance",
-                (reward_amount, user_id)
-            )
-            new_balance = cur.fetchone()[0]
+            today = date.today()
+            statements.execute(cur, CLAIM, (user_id, today, REWARD_AMOUNT))
+            new_balance, user_exists = cur.fetchone()
             
-            if row:
-                cur.execute(
-                    "UPDATE daily_rewards SET last_claim_date = %s WHERE user_id = %s",
-                    (today, user_id)
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO daily_rewards (user_id, last_claim_date) VALUES (%s, %s)",
-                    (user_id, today)
-                )
+            if not user_exists:
+                conn.rollback()
+                return error_response(404, 'User not found')
             
-            conn.commit()
+            if new_balance is None:
+                conn.rollback()
+                claimed_today.add(today, [int(user_id)])
+                return error_response(400, 'Already claimed today')
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'reward_amount': reward_amount,
-                    'new_balance': new_balance
-                })
-            }
+            response = idempotency.commit(conn, cur, idempotency_key, request_fingerprint, json_response(200, {
+                'success': True,
+                'reward_amount': REWARD_AMOUNT,
+                'new_balance': new_balance
+            }))
+            # Only once the claim is durable: a remembered user is answered
+            # "already claimed" with a cache lifetime until midnight
+            claimed_today.add(today, [int(user_id)])
+            maybe_compact(conn, cur)
+            return response
         
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+            return error_response(405, 'Method not allowed')
     
     finally:
         cur.close()
-        conn.close()
+        pool.putconn(conn)
@@ -0,0 +1,77 @@
+'''
+Registry of the hot parameterized statements. Each statement is registered
+once under a name with $n placeholders and explicit parameter types, PREPAREd
+the first time it runs on a pooled connection and from then on sent as
+EXECUTE, so Postgres parses and plans it once per connection instead of on
+every call. stats() reports calls, prepares and cumulative time per statement.
+'''
+import threading
+import time
+import weakref
+from typing import Any, Dict, Sequence, Set
+
+
+class Statement:
+    __slots__ = ('name', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name: str, sql: str, types: Sequence[str]):
+        self.name = name
+        signature = f' ({", ".join(types)})' if types else ''
+        self.prepare_sql = f'PREPARE {name}{signature} AS {sql}'
+        self.execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * len(types))})' if types else f'EXECUTE {name}'
+
+
+class StatementRegistry:
+    def __init__(self):
+        self._statements: Dict[str, Statement] = {}
+        self._prepared: 'weakref.WeakKeyDictionary[Any, Set[str]]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def register(self, name: str, sql: str, types: Sequence[str] = ()) -> str:
+        '''
+        Registers sql, written with $1..$n placeholders of the given types,
+        and returns the name to execute it by
+        '''
+        with self._lock:
+            if name in self._statements:
+                raise ValueError(f'Statement {name} is already registered')
+            self._statements[name] = Statement(name, sql, types)
+            self._stats[name] = {'calls': 0, 'prepares': 0, 'seconds': 0.0}
+        return name
+
+    def execute(self, cur: Any, name: str, params: Sequence[Any] = ()) -> None:
+        statement = self._statements[name]
+        conn = cur.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            needs_prepare = name not in prepared
+
+        started = time.perf_counter()
+        if needs_prepare:
+            cur.execute(statement.prepare_sql)
+            with self._lock:
+                prepared.add(name)
+        cur.execute(statement.execute_sql, tuple(params))
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            entry = self._stats[name]
+            entry['calls'] += 1
+            entry['prepares'] += needs_prepare
+            entry['seconds'] += elapsed
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    'calls': int(entry['calls']),
+                    'prepares': int(entry['prepares']),
+                    'total_ms': round(entry['seconds'] * 1000, 3),
+                    'avg_ms': round(entry['seconds'] * 1000 / entry['calls'], 3) if entry['calls'] else None
+                }
+                for name, entry in self._stats.items()
+            }
+
+
+statements = StatementRegistry()
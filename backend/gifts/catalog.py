@@ -0,0 +1,78 @@
+'''
+In-process cache of the serialized gift catalog. The cached body is reused
+until catalog_version changes; the version row is re-read at most once per
+CATALOG_REVALIDATE_SECONDS, and add_gift in this instance invalidates at once.
+'''
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+from responses import dumps
+from statements import statements
+from timing import phase
+
+CATALOG_REVALIDATE_SECONDS = float(os.environ.get('CATALOG_REVALIDATE_SECONDS', '5'))
+CATALOG_MAX_AGE_SECONDS = int(os.environ.get('CATALOG_MAX_AGE_SECONDS', '30'))
+
+BUMP_VERSION_SQL = "UPDATE catalog_version SET version = version + 1"
+
+CATALOG_VERSION = statements.register('catalog_version', 'SELECT version FROM catalog_version')
+
+
+class CatalogCache:
+    def __init__(self, revalidate_after: float = CATALOG_REVALIDATE_SECONDS):
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._body: Optional[str] = None
+        self._etag: Optional[str] = None
+        self._checked_at = 0.0
+
+    def get(self, cur: Any) -> Tuple[str, str]:
+        '''
+        Returns the serialized catalog body and its ETag
+        '''
+        with self._lock:
+            if self._body is not None and time.monotonic() - self._checked_at < self.revalidate_after:
+                return self._body, self._etag
+
+            statements.execute(cur, CATALOG_VERSION)
+            version = cur.fetchone()[0]
+            if version != self._version or self._body is None:
+                cur.execute("SELECT id, name, description, price, icon, category FROM gifts ORDER BY id")
+                gifts = [{
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'price': row[3],
+                    'icon': row[4],
+                    'category': row[5]
+                } for row in cur.fetchall()]
+                with phase('serialize'):
+                    self._body = dumps({'gifts': gifts})
+                self._etag = '"' + hashlib.sha256(self._body.encode('utf-8')).hexdigest()[:32] + '"'
+                self._version = version
+            self._checked_at = time.monotonic()
+            return self._body, self._etag
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,157 @@
+'''
+Idempotency-Key support for POSTs that move coins. The key is claimed with a
+placeholder row before the operation runs, and the response is written into
+it in the same transaction, so a key is never recorded for work that did not
+commit. A concurrent duplicate blocks on the placeholder until the first
+request commits, then replays the stored response without running the
+operation. Recent keys are also kept in an in-process LRU, so a retry served
+by the same instance needs no connection.
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from responses import error_response, raw_json_response
+from timing import note
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_PURGE_EVERY = int(os.environ.get('IDEMPOTENCY_PURGE_EVERY', '1000'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+REPLAY_HEADERS = {'Idempotent-Replayed': 'true'}
+
+# The placeholder (status 0) is only ever committed with the response written
+# into it. An expired row is overwritten in place; a live one makes the INSERT
+# return nothing, after waiting for the transaction that wrote it.
+CLAIM_SQL = '''
+    INSERT INTO idempotency_keys (scope, key, fingerprint, status, body)
+    VALUES (%(scope)s, %(key)s, %(fingerprint)s, 0, '')
+    ON CONFLICT (scope, key) DO UPDATE SET
+        fingerprint = EXCLUDED.fingerprint, status = 0, body = '', created_at = CURRENT_TIMESTAMP
+    WHERE idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+    RETURNING 1
+'''
+
+SAVE_SQL = '''
+    UPDATE idempotency_keys SET status = %(status)s, body = %(body)s
+    WHERE scope = %(scope)s AND key = %(key)s
+'''
+
+LOAD_SQL = '''
+    SELECT fingerprint, status, body FROM idempotency_keys
+    WHERE scope = %(scope)s AND key = %(key)s
+      AND created_at >= CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+'''
+
+PURGE_SQL = '''
+    DELETE FROM idempotency_keys
+    WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+'''
+
+Stored = Tuple[str, int, str]
+
+
+def key_from_event(event: Dict[str, Any]) -> Optional[str]:
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == IDEMPOTENCY_HEADER.lower() and value:
+            return value.strip()
+    return None
+
+
+def fingerprint(event: Dict[str, Any]) -> str:
+    return hashlib.sha256((event.get('body') or '').encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, scope: str, ttl: int = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.scope = scope
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._recent: 'OrderedDict[str, Tuple[float, Stored]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+
+    def _replay(self, request_fingerprint: str, stored: Stored) -> Dict[str, Any]:
+        stored_fingerprint, status, body = stored
+        if stored_fingerprint != request_fingerprint:
+            note('idempotency', 'mismatch')
+            return error_response(422, f'{IDEMPOTENCY_HEADER} was already used for a different request')
+        note('idempotency', 'replay')
+        return raw_json_response(status, body, REPLAY_HEADERS)
+
+    def _remember(self, key: str, stored: Stored) -> None:
+        with self._lock:
+            self._recent[key] = (time.monotonic() + self.ttl, stored)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_keys:
+                self._recent.popitem(last=False)
+
+    def begin(self, event: Dict[str, Any]) -> Tuple[Optional[str], str, Optional[Dict[str, Any]]]:
+        '''
+        Returns the request's key, its fingerprint and, when the request can
+        be answered before any database work, the response: an invalid key
+        error or a replay remembered by this instance
+        '''
+        key = key_from_event(event)
+        request_fingerprint = fingerprint(event)
+        if key is None:
+            return None, request_fingerprint, None
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return key, request_fingerprint, error_response(
+                400, f'{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'
+            )
+        with self._lock:
+            entry = self._recent.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._recent[key]
+                entry = None
+            if entry is not None:
+                self._recent.move_to_end(key)
+        if entry is None:
+            return key, request_fingerprint, None
+        return key, request_fingerprint, self._replay(request_fingerprint, entry[1])
+
+    def claim(self, cur: Any, key: str, request_fingerprint: str) -> Optional[Dict[str, Any]]:
+        '''
+        Claims key for the open transaction before the operation runs.
+        Returns None when claimed, else the response stored by the request
+        that holds the key, once that request has committed.
+        '''
+        cur.execute(CLAIM_SQL, {'scope': self.scope, 'key': key, 'fingerprint': request_fingerprint, 'ttl': self.ttl})
+        if cur.fetchone() is not None:
+            return None
+        cur.execute(LOAD_SQL, {'scope': self.scope, 'key': key, 'ttl': self.ttl})
+        row = cur.fetchone()
+        if row is None:
+            return error_response(409, f'{IDEMPOTENCY_HEADER} is in use')
+        stored = (row[0], row[1], row[2])
+        self._remember(key, stored)
+        return self._replay(request_fingerprint, stored)
+
+    def commit(self, conn: Any, cur: Any, key: Optional[str], request_fingerprint: str,
+               response: Dict[str, Any]) -> Dict[str, Any]:
+        '''
+        Commits the open transaction together with the response for key,
+        which claim() must have claimed in this transaction
+        '''
+        if key is None:
+            conn.commit()
+            return response
+
+        stored = (request_fingerprint, response['statusCode'], response['body'])
+        cur.execute(SAVE_SQL, {'scope': self.scope, 'key': key, 'status': stored[1], 'body': stored[2]})
+        conn.commit()
+        self._remember(key, stored)
+
+        with self._lock:
+            self._stores += 1
+            purge = IDEMPOTENCY_PURGE_EVERY and self._stores % IDEMPOTENCY_PURGE_EVERY == 0
+        if purge:
+            cur.execute(PURGE_SQL, {'ttl': self.ttl})
+            conn.commit()
+        return response
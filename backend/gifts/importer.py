@@ -0,0 +1,95 @@
+'''
+Bulk gift import. Rows arrive as CSV (with a header row) or NDJSON, are
+validated one at a time and written straight into a CSV buffer that is loaded
+with a single COPY, so a large catalog goes in with one statement and one
+transaction. Any invalid row rejects the whole import.
+'''
+import csv
+import io
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+GIFT_IMPORT_MAX_ROWS = int(os.environ.get('GIFT_IMPORT_MAX_ROWS', '10000'))
+GIFT_IMPORT_MAX_ERRORS = 20
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+COLUMNS = ('name', 'description', 'price', 'icon', 'category')
+COPY_SQL = 'COPY gifts (name, description, price, icon, category) FROM STDIN WITH (FORMAT csv)'
+
+# column -> max length, matching the gifts table
+TEXT_LIMITS = {'name': 100, 'icon': 50, 'category': 50}
+PRICE_MAX = 2147483647  # gifts.price is INTEGER
+DEFAULTS = {'icon': 'Gift', 'category': 'general'}
+
+
+def iter_records(fmt: str, data: str) -> Iterator[Tuple[int, Any]]:
+    '''
+    Yields (line number, record) pairs; a record that cannot be parsed is
+    yielded as None
+    '''
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(data))
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+
+def validate(record: Any) -> Tuple[Optional[Tuple[Any, ...]], Optional[str]]:
+    if not isinstance(record, dict):
+        return None, 'not an object'
+    unknown = set(record) - set(COLUMNS)
+    if unknown:
+        return None, f'unknown columns: {", ".join(sorted(str(c) for c in unknown))}'
+
+    values: Dict[str, Any] = {}
+    for column, limit in TEXT_LIMITS.items():
+        value = record.get(column) or DEFAULTS.get(column)
+        if not isinstance(value, str) or not value.strip() or len(value) > limit:
+            return None, f'{column} must be 1-{limit} characters'
+        values[column] = value.strip()
+
+    description = record.get('description')
+    if description is not None and not isinstance(description, str):
+        return None, 'description must be text'
+
+    price = record.get('price')
+    if isinstance(price, str) and price.strip().isascii() and price.strip().isdigit():
+        price = int(price)
+    if not isinstance(price, int) or isinstance(price, bool) or not 0 <= price <= PRICE_MAX:
+        return None, f'price must be an integer 0-{PRICE_MAX}'
+
+    return (values['name'], description or None, price, values['icon'], values['category']), None
+
+
+def build_copy_buffer(fmt: str, data: str) -> Tuple[io.StringIO, int, List[Dict[str, Any]]]:
+    '''
+    Returns the COPY input, the number of rows in it and the errors found
+    (at most GIFT_IMPORT_MAX_ERRORS); rows are only usable when there are
+    no errors
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    errors: List[Dict[str, Any]] = []
+    for line_no, record in iter_records(fmt, data):
+        count += 1
+        if count > GIFT_IMPORT_MAX_ROWS:
+            errors.append({'line': line_no, 'error': f'more than {GIFT_IMPORT_MAX_ROWS} rows'})
+            break
+        row, error = validate(record)
+        if error:
+            errors.append({'line': line_no, 'error': error})
+            if len(errors) >= GIFT_IMPORT_MAX_ERRORS:
+                break
+            continue
+        writer.writerow(row)
+    buffer.seek(0)
+    return buffer, count, errors
@@ -1,45 +1,299 @@
 import json
-import os
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
+from catalog import BUMP_VERSION_SQL, CATALOG_MAX_AGE_SECONDS, catalog_cache, etag_matches
+from db import get_pool, get_read_pool
+from idempotency import IdempotencyStore
+from importer import COPY_SQL, GIFT_IMPORT_MAX_ROWS, IMPORT_FORMATS, build_copy_buffer
+from ledger import FOLD_PENDING_SQL
+from responses import empty_response, error_response, json_response, preflight_response, raw_json_response
+from statements import statements
+from timing import instrumented, note
+from tokens import claims_from_event
+
+CART_MAX_ITEMS = 100
+IDEMPOTENT_ACTIONS = ('purchase', 'checkout')
+CATALOG_PAGE_DEFAULT = 50
+CATALOG_PAGE_MAX = 200
+INVENTORY_PAGE_DEFAULT = 100
+INVENTORY_PAGE_MAX = 500
+CATALOG_PAGE_PARAMS = ('category', 'min_price', 'max_price', 'sort', 'limit', 'cursor')
+
+# sort parameter -> (ORDER BY clause, keyset comparison against the cursor)
+CATALOG_SORTS = {
+    'id': ('g.id', 'g.id > %s'),
+    'price_asc': ('g.price, g.id', '(g.price, g.id) > (%s, %s)'),
+    'price_desc': ('g.price DESC, g.id DESC', '(g.price, g.id) < (%s, %s)')
+}
+
+# Debit and ownership insert in one round trip. The user's pending ledger
+# credits are folded into the debited balance (see ledger.py); the INSERT only
+# runs when the conditional debit succeeded, and the unique (user_id, gift_id)
+# index turns a concurrent duplicate purchase into an IntegrityError that
+# rolls back the debit.
+PURCHASE_SQL = '''
+    WITH g AS (
+        SELECT id, price FROM gifts WHERE id = $2
+    ),
+    pending AS (
+        UPDATE coin_ledger SET compacted = TRUE
+        WHERE user_id = $1 AND NOT compacted
+        RETURNING delta
+    ),
+    debit AS (
+        UPDATE users SET balance = users.balance + (SELECT COALESCE(sum(delta), 0) FROM pending) - g.price
+        FROM g
+        WHERE users.id = $1
+          AND users.balance + (SELECT COALESCE(sum(delta), 0) FROM pending) >= g.price
+          AND NOT EXISTS (
+              SELECT 1 FROM user_gifts WHERE user_id = $1 AND gift_id = g.id
+          )
+        RETURNING users.id, users.balance
+    ),
+    ins AS (
+        INSERT INTO user_gifts (user_id, gift_id)
+        SELECT debit.id, g.id FROM g, debit
+        RETURNING id
+    ),
+    entry AS (
+        INSERT INTO coin_ledger (user_id, delta, reason, compacted)
+        SELECT debit.id, -g.price, 'purchase', TRUE FROM g, debit
+    )
+    SELECT
+        (SELECT balance FROM debit),
+        (SELECT balance + pending_coins(id) FROM users WHERE id = $1),
+        (SELECT price FROM g),
+        EXISTS (SELECT 1 FROM user_gifts WHERE user_id = $1 AND gift_id = $2)
+'''
+
+PURCHASE = statements.register('gifts_purchase', PURCHASE_SQL, ('integer', 'integer'))
+FOLD_PENDING = statements.register('gifts_fold_pending', FOLD_PENDING_SQL, ('integer',))
+CART_LOOKUP = statements.register('gifts_cart_lookup', '''
+    SELECT g.id, g.price, ug.id IS NOT NULL
+    FROM gifts g
+    LEFT JOIN user_gifts ug ON ug.gift_id = g.id AND ug.user_id = $1
+    WHERE g.id = ANY($2)
+''', ('integer', 'integer[]'))
+ADMIN_FLAG = statements.register('gifts_admin_flag', 'SELECT is_admin FROM users WHERE username = $1', ('varchar',))
+
+idempotency = IdempotencyStore('gifts')
+
+def check_admin(event: Dict[str, Any], cur: Any, admin_username: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''
+    Authorizes catalog changes from the session token claims, falling back to
+    looking up admin_username (compatibility path, noted as admin_auth=username)
+    '''
+    claims = claims_from_event(event)
+    if claims:
+        is_admin = claims.get('adm') and not claims.get('ban')
+    elif admin_username:
+        note('admin_auth', 'username')
+        statements.execute(cur, ADMIN_FLAG, (admin_username,))
+        admin_check = cur.fetchone()
+        is_admin = admin_check and admin_check[0]
+    else:
+        return error_response(403, 'Admin access required')
+    
+    if not is_admin:
+        return error_response(403, 'Access denied')
+    return None
+
+def header_value(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def build_catalog_page_query(params: Dict[str, Any]) -> Tuple[str, List[Any], int, str]:
+    '''
+    Keyset page over the catalog filtered by category and price range. cursor
+    is the next_cursor of the previous page: "<id>" for sort=id and
+    "<price>:<id>" for the price sorts. With user_id each gift carries purchased.
+    '''
+    sort = params.get('sort') or 'id'
+    if sort not in CATALOG_SORTS:
+        raise ValueError(sort)
+    order_by, after = CATALOG_SORTS[sort]
+    
+    limit = int(params.get('limit') or CATALOG_PAGE_DEFAULT)
+    if limit < 1 or limit > CATALOG_PAGE_MAX:
+        raise ValueError(limit)
+    
+    conditions: List[str] = []
+    values: List[Any] = []
+    
+    user_id = params.get('user_id')
+    if user_id:
+        columns = 'g.id, g.name, g.description, g.price, g.icon, g.category, ug.purchased_at IS NOT NULL'
+        source = 'gifts g LEFT JOIN user_gifts ug ON g.id = ug.gift_id AND ug.user_id = %s'
+        values.append(int(user_id))
+    else:
+        columns = 'g.id, g.name, g.description, g.price, g.icon, g.category'
+        source = 'gifts g'
+    
+    if params.get('category'):
+        conditions.append('g.category = %s')
+        values.append(params['category'])
+    if params.get('min_price'):
+        conditions.append('g.price >= %s')
+        values.append(int(params['min_price']))
+    if params.get('max_price'):
+        conditions.append('g.price <= %s')
+        values.append(int(params['max_price']))
+    
+    cursor = params.get('cursor')
+    if cursor:
+        keys = [int(k) for k in cursor.split(':')]
+        if len(keys) != after.count('%s'):
+            raise ValueError(cursor)
+        conditions.append(after)
+        values.extend(keys)
+    
+    values.append(limit + 1)
+    query = (
+        f'SELECT {columns} FROM {source}'
+        + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+        + f' ORDER BY {order_by} LIMIT %s'
+    )
+    return query, values, limit, sort
+
+def build_inventory_page_query(params: Dict[str, Any]) -> Tuple[str, List[Any], int]:
+    '''
+    Keyset page over one user's purchases, newest first. cursor is the
+    user_gifts id returned as next_cursor by the previous page.
+    '''
+    limit = int(params.get('limit') or INVENTORY_PAGE_DEFAULT)
+    if limit < 1 or limit > INVENTORY_PAGE_MAX:
+        raise ValueError(limit)
+    
+    user_id = int(params['user_id'])
+    conditions = ['user_id = %s']
+    values: List[Any] = [user_id]
+    
+    if params.get('cursor'):
+        conditions.append(
+            '(purchased_at, id) < (SELECT purchased_at, id FROM user_gifts WHERE id = %s AND user_id = %s)'
+        )
+        values.extend([int(params['cursor']), user_id])
+    
+    values.append(limit + 1)
+    query = (
+        'SELECT id, gift_id, purchased_at FROM user_gifts '
+        'WHERE ' + ' AND '.join(conditions) + ' ORDER BY purchased_at DESC, id DESC LIMIT %s'
+    )
+    return query, values, limit
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Gift shop - list gifts and purchase with currency
-    Args: event with httpMethod (GET/POST), body with user_id, gift_id
-    Returns: HTTP response with gifts list or purchase result
+    Args: event with httpMethod (GET/POST), If-None-Match and Idempotency-Key headers, query with optional user_id and
+          category, min_price, max_price, sort, limit, cursor (or action inventory with user_id,
+          limit, cursor), body with user_id, gift_id (or action import_gifts with format, data)
+          (or action checkout with user_id, gift_ids)
+    Returns: HTTP response with gifts list (304 when the catalog ETag matches), owned gifts or purchase result
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        return preflight_response()
+    
+    body_data = json.loads(event.get('body', '{}')) if method == 'POST' else {}
+    action = body_data.get('action', 'purchase')
+    
+    # Only purchases move coins; the admin actions ignore Idempotency-Key
+    idempotency_key, request_fingerprint, replay = (
+        idempotency.begin(event) if method == 'POST' and action in IDEMPOTENT_ACTIONS else (None, '', None)
+    )
+    if replay:
+        return replay
+    
+    # The plain catalog is the same for everyone and may lag on the replica.
+    # Anything with user_id (the inventory and the catalog marked with the
+    # user's purchases) must show a purchase that just committed, so it stays
+    # on the primary
+    params = event.get('queryStringParameters') or {}
+    pool = get_read_pool() if method == 'GET' and not params.get('user_id') else get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
         if method == 'GET':
-            params = event.get('queryStringParameters') or {}
             user_id = params.get('user_id')
             
-            if user_id:
-                cur.execute("""
-                    SELECT g.id, g.name, g.description, g.price, g.icon, g.category, ug.purchased_at
-                    FROM gifts g
-                    LEFT JOIN user_gifts ug ON g.id = ug.gift_id AND ug.user_id = %s
-                    ORDER BY g.id
-                """, (user_id,))
-            else:
-                cur.execute("SELECT id, name, description, price, icon, category FROM gifts ORDER BY id")
+            if params.get('action') == 'inventory':
+                if not user_id:
+                    return error_response(400, 'user_id required')
+                try:
+                    query, values, limit = build_inventory_page_query(params)
+                except ValueError:
+                    return error_response(400, f'Invalid inventory parameters (limit 1-{INVENTORY_PAGE_MAX})')
+                
+                cur.execute(query, values)
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
+                items = [{
+                    'gift_id': row[1],
+                    'purchased_at': row[2].isoformat() if row[2] else None
+                } for row in rows]
+                
+                return json_response(200, {
+                    'items': items,
+                    'next_cursor': rows[-1][0] if has_more else None
+                })
+            
+            if any(params.get(name) for name in CATALOG_PAGE_PARAMS):
+                try:
+                    query, values, limit, sort = build_catalog_page_query(params)
+                except ValueError:
+                    return error_response(400, f'Invalid catalog parameters (sort: {", ".join(CATALOG_SORTS)}, limit 1-{CATALOG_PAGE_MAX})')
+                
+                cur.execute(query, values)
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
+                gifts = []
+                for row in rows:
+                    gift = {
+                        'id': row[0],
+                        'name': row[1],
+                        'description': row[2],
+                        'price': row[3],
+                        'icon': row[4],
+                        'category': row[5]
+                    }
+                    if user_id:
+                        gift['purchased'] = row[6]
+                    gifts.append(gift)
+                
+                next_cursor = None
+                if has_more:
+                    last = rows[-1]
+                    next_cursor = str(last[0]) if sort == 'id' else f'{last[3]}:{last[0]}'
+                
+                return json_response(200, {'gifts': gifts, 'next_cursor': next_cursor})
+            
+            if not user_id:
+                body, etag = catalog_cache.get(cur)
+                caching_headers = {
+                    'ETag': etag,
+                    'Cache-Control': f'public, max-age={CATALOG_MAX_AGE_SECONDS}'
+                }
+                if etag_matches(header_value(event, 'If-None-Match'), etag):
+                    return empty_response(304, caching_headers)
+                return raw_json_response(200, body, caching_headers)
+            
+            cur.execute("""
+                SELECT g.id, g.name, g.description, g.price, g.icon, g.category, ug.purchased_at
+                FROM gifts g
+                LEFT JOIN user_gifts ug ON g.id = ug.gift_id AND ug.user_id = %s
+                ORDER BY g.id
+            """, (user_id,))
             
             gifts = []
             for row in cur.fetchall():
@@ -49,148 +303,163 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'description': row[2],
                     'price': row[3],
                     'icon': row[4],
-                    'category': row[5]
+                    'category': row[5],
+                    'purchased': row[6] is not None
                 }
-                if user_id and len(row) > 6:
-                    gift['purchased'] = row[6] is not None
                 gifts.append(gift)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'gifts': gifts})
-            }
+            return json_response(200, {'gifts': gifts})
         
         elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action', 'purchase')
+            if idempotency_key:
+                replay = idempotency.claim(cur, idempotency_key, request_fingerprint)
+                if replay:
+                    return replay
             
             if action == 'add_gift':
-                admin_username = body_data.get('admin_username')
                 name = body_data.get('name')
                 description = body_data.get('description')
                 price = body_data.get('price')
                 icon = body_data.get('icon', 'Gift')
                 category = body_data.get('category', 'general')
                 
-                if not admin_username:
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Admin access required'})
-                    }
-                
-                cur.execute("SELECT is_admin FROM users WHERE username = %s", (admin_username,))
-                admin_check = cur.fetchone()
-                if not admin_check or not admin_check[0]:
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Access denied'})
-                    }
+                admin_error = check_admin(event, cur, body_data.get('admin_username'))
+                if admin_error:
+                    return admin_error
                 
                 cur.execute(
                     "INSERT INTO gifts (name, description, price, icon, category) VALUES (%s, %s, %s, %s, %s) RETURNING id",
                     (name, description, price, icon, category)
                 )
                 gift_id = cur.fetchone()[0]
+                cur.execute(BUMP_VERSION_SQL)
                 conn.commit()
+                catalog_cache.invalidate()
+                
+                return json_response(200, {
+                    'success': True,
+                    'gift_id': gift_id,
+                    'message': 'Gift added successfully'
+                })
+            
+            if action == 'import_gifts':
+                admin_error = check_admin(event, cur, body_data.get('admin_username'))
+                if admin_error:
+                    return admin_error
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'gift_id': gift_id,
-                        'message': 'Gift added successfully'
+                fmt = body_data.get('format', 'csv')
+                data = body_data.get('data')
+                
+                if fmt not in IMPORT_FORMATS or not isinstance(data, str) or not data.strip():
+                    return error_response(400, f'format ({", ".join(IMPORT_FORMATS)}) and data required')
+                
+                buffer, count, errors = build_copy_buffer(fmt, data)
+                if errors:
+                    return json_response(400, {
+                        'error': f'Import rejected (at most {GIFT_IMPORT_MAX_ROWS} valid rows)',
+                        'errors': errors
                     })
-                }
+                
+                cur.copy_expert(COPY_SQL, buffer)
+                cur.execute(BUMP_VERSION_SQL)
+                conn.commit()
+                catalog_cache.invalidate()
+                
+                return json_response(200, {
+                    'success': True,
+                    'imported': count
+                })
+            
+            if action == 'checkout':
+                user_id = body_data.get('user_id')
+                gift_ids = body_data.get('gift_ids')
+                
+                if (not user_id or not isinstance(gift_ids, list) or not gift_ids
+                        or len(gift_ids) > CART_MAX_ITEMS
+                        or not all(isinstance(g, int) and not isinstance(g, bool) for g in gift_ids)):
+                    return error_response(400, f'user_id and gift_ids (1-{CART_MAX_ITEMS} integers) required')
+                
+                gift_ids = list(dict.fromkeys(gift_ids))
+                
+                statements.execute(cur, FOLD_PENDING, (user_id,))
+                user_row = cur.fetchone()
+                if not user_row:
+                    conn.rollback()
+                    return error_response(404, 'User not found')
+                
+                statements.execute(cur, CART_LOOKUP, (user_id, gift_ids))
+                found = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+                
+                results = []
+                to_buy = []
+                total = 0
+                for gid in gift_ids:
+                    if gid not in found:
+                        results.append({'gift_id': gid, 'status': 'not_found'})
+                    elif found[gid][1]:
+                        results.append({'gift_id': gid, 'status': 'already_purchased'})
+                    else:
+                        results.append({'gift_id': gid, 'status': 'purchased', 'price': found[gid][0]})
+                        to_buy.append(gid)
+                        total += found[gid][0]
+                
+                if user_row[0] < total:
+                    conn.rollback()
+                    return json_response(400, {'error': 'Insufficient balance', 'total': total, 'balance': user_row[0]})
+                
+                new_balance = user_row[0]
+                if to_buy:
+                    cur.execute(
+                        "UPDATE users SET balance = balance - %s WHERE id = %s RETURNING balance",
+                        (total, user_id)
+                    )
+                    new_balance = cur.fetchone()[0]
+                    cur.execute(
+                        "INSERT INTO user_gifts (user_id, gift_id) SELECT %s::integer, unnest(%s::integer[])",
+                        (user_id, to_buy)
+                    )
+                    cur.execute(
+                        "INSERT INTO coin_ledger (user_id, delta, reason, compacted) VALUES (%s, %s, 'checkout', TRUE)",
+                        (user_id, -total)
+                    )
+                return idempotency.commit(conn, cur, idempotency_key, request_fingerprint, json_response(200, {
+                    'success': bool(to_buy),
+                    'total': total,
+                    'new_balance': new_balance,
+                    'results': results
+                }))
             
             user_id = body_data.get('user_id')
             gift_id = body_data.get('gift_id')
             
             if not user_id or not gift_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'user_id and gift_id required'})
-                }
+                return error_response(400, 'user_id and gift_id required')
             
-            cur.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-            user_row = cur.fetchone()
-            if not user_row:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'User not found'})
-                }
+            try:
+                statements.execute(cur, PURCHASE, (user_id, gift_id))
+                new_balance, balance, price, owned = cur.fetchone()
+            except psycopg2.IntegrityError:
+                conn.rollback()
+                return error_response(400, 'Gift already purchased')
             
-            balance = user_row[0]
+            if new_balance is None:
+                conn.rollback()
+                if balance is None:
+                    return error_response(404, 'User not found')
+                if price is None:
+                    return error_response(404, 'Gift not found')
+                if owned and balance >= price:
+                    return error_response(400, 'Gift already purchased')
+                return error_response(400, 'Insufficient balance')
             
-            cur.execute("SELECT price FROM gifts WHERE id = %s", (gift_id,))
-            gift_row = cur.fetchone()
-            if not gift_row:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Gift not found'})
-                }
-            
-            price = gift_row[0]
-            
-            if balance < price:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Insufficient balance'})
-                }
-            
-            cur.execute(
-                "SELECT id FROM user_gifts WHERE user_id = %s AND gift_id = %s",
-                (user_id, gift_id)
-            )
-            if cur.fetchone():
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Gift already purchased'})
-                }
-            
-            new_balance = balance - price
-            cur.execute("UPDATE users SET balance = %s WHERE id = %s", (new_balance, user_id))
-            cur.execute(
-                "INSERT INTO user_gifts (user_id, gift_id) VALUES (%s, %s)",
-                (user_id, gift_id)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'new_balance': new_balance
-                })
-            }
+            return idempotency.commit(conn, cur, idempotency_key, request_fingerprint, json_response(200, {
+                'success': True,
+                'new_balance': new_balance
+            }))
         
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+            return error_response(405, 'Method not allowed')
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        pool.putconn(conn)
\ No newline at end of file
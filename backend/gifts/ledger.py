@@ -0,0 +1,116 @@
+'''
+Append-only coin ledger. Credits are plain inserts into coin_ledger that leave
+users.balance alone, so bursts of rewards and grants never queue on the users
+row lock. A user's spendable balance is users.balance + pending_coins(id)
+until the pending credits are folded into users.balance: by the user's next
+debit, which has to lock the row for the overdraft check anyway, or by a
+compaction batch. Credit paths run a small batch through maybe_compact() at
+most once per LEDGER_COMPACT_INTERVAL_SECONDS per instance, so pending credits
+of users who never buy anything are folded too; the compact_ledger admin
+action runs full batches.
+'''
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Tuple
+
+import psycopg2
+
+from timing import note, phase
+
+LEDGER_COMPACT_BATCH = int(os.environ.get('LEDGER_COMPACT_BATCH', '10000'))
+# Batch run on a credit request after its commit: small enough that the caller
+# barely notices and few users rows are locked at a time
+LEDGER_COMPACT_REQUEST_BATCH = int(os.environ.get('LEDGER_COMPACT_REQUEST_BATCH', '200'))
+LEDGER_COMPACT_INTERVAL_SECONDS = float(os.environ.get('LEDGER_COMPACT_INTERVAL_SECONDS', '10'))
+
+# Arbitrary key of the advisory lock that keeps compaction batches from
+# running concurrently (and from locking users rows in conflicting orders).
+COMPACT_LOCK_KEY = 7302
+
+# Folds one user's pending credits and locks the users row for a debit
+# (registered as a prepared statement, hence the $1 placeholder). The
+# ledger UPDATE locks the pending rows, so a concurrent fold or compaction
+# either skips them or waits and then sees them compacted: every credit is
+# applied exactly once. Roll back instead of committing if the debit is
+# abandoned, so the credits stay pending.
+FOLD_PENDING_SQL = '''
+    WITH folded AS (
+        UPDATE coin_ledger SET compacted = TRUE
+        WHERE user_id = $1 AND NOT compacted
+        RETURNING delta
+    )
+    UPDATE users SET balance = balance + (SELECT COALESCE(sum(delta), 0) FROM folded)
+    WHERE id = $1
+    RETURNING balance
+'''
+
+COMPACT_SQL = '''
+    WITH batch AS (
+        SELECT id FROM coin_ledger WHERE NOT compacted LIMIT %(batch)s FOR UPDATE SKIP LOCKED
+    ),
+    folded AS (
+        UPDATE coin_ledger l SET compacted = TRUE FROM batch
+        WHERE l.id = batch.id
+        RETURNING l.user_id, l.delta
+    ),
+    totals AS (
+        SELECT user_id, sum(delta) AS delta FROM folded GROUP BY user_id
+    ),
+    applied AS (
+        UPDATE users u SET balance = u.balance + totals.delta FROM totals
+        WHERE u.id = totals.user_id
+        RETURNING u.id
+    )
+    SELECT (SELECT count(*) FROM folded), (SELECT count(*) FROM applied)
+'''
+
+
+def compact(cur: Any, batch: int = LEDGER_COMPACT_BATCH) -> Tuple[int, int]:
+    '''
+    Folds up to batch pending entries into users.balance. Returns the number
+    of entries and users folded, (0, 0) when another compaction is running.
+    The caller commits.
+    '''
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (COMPACT_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        return 0, 0
+    cur.execute(COMPACT_SQL, {'batch': batch})
+    entries, users = cur.fetchone()
+    return entries, users
+
+
+_last_compaction = 0.0
+_schedule_lock = threading.Lock()
+
+
+def maybe_compact(conn: Any, cur: Any, interval: float = LEDGER_COMPACT_INTERVAL_SECONDS,
+                  batch: int = LEDGER_COMPACT_REQUEST_BATCH) -> None:
+    '''
+    Runs and commits one compaction batch when this instance has not tried
+    for interval seconds. Call it after the request's own transaction has
+    been committed; it never raises, since that work is already done. A
+    failed batch is rolled back, logged and left to the next attempt.
+    '''
+    global _last_compaction
+    now = time.monotonic()
+    with _schedule_lock:
+        if now - _last_compaction < interval:
+            return
+        _last_compaction = now
+    try:
+        with phase('compact'):
+            entries, _ = compact(cur, batch)
+            conn.commit()
+    except Exception as exc:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        note('compacted', 'failed')
+        print(json.dumps({'type': 'ledger', 'event': 'compaction_failed', 'error': f'{type(exc).__name__}: {exc}'}),
+              file=sys.stdout, flush=True)
+        return
+    note('compacted', entries)
@@ -0,0 +1,228 @@
+'''
+Warm PostgreSQL connection pool kept at module level, so a function instance
+reuses its connections between invocations instead of reconnecting every time.
+When DATABASE_READ_URL is set, get_read_pool() sends side-effect-free queries
+to that server (a replica) through a second pool.
+'''
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from timing import TIMING_ENABLED, TimedCursor, note, phase
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_MAX_IDLE_SECONDS = float(os.environ.get('DB_POOL_MAX_IDLE_SECONDS', '300'))
+POOL_PING_AFTER_SECONDS = float(os.environ.get('DB_POOL_PING_AFTER_SECONDS', '30'))
+POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT_SECONDS', '10'))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Thread-safe pool capped at max_size open connections. Idle connections are
+    health-checked before reuse and broken ones are replaced transparently.
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE,
+                 max_idle: float = POOL_MAX_IDLE_SECONDS,
+                 ping_after: float = POOL_PING_AFTER_SECONDS,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT_SECONDS,
+                 read_only: bool = False):
+        self.dsn = dsn
+        self.read_only = read_only
+        self.max_size = max(1, max_size)
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[Any, float]] = []
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {'reused': 0, 'opened': 0, 'discarded': 0, 'waited': 0}
+
+    def getconn(self) -> Any:
+        with phase('checkout'):
+            return self._checkout()
+
+    def _checkout(self) -> Any:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted(f'No free connection within {self.acquire_timeout}s')
+                    self._stats['waited'] += 1
+                    self._cond.wait(remaining)
+                self._in_use += 1
+                candidate = self._idle.pop() if self._idle else None
+
+            if candidate is None:
+                return self._connect()
+
+            conn, last_used = candidate
+            usable = self._is_usable(conn, last_used)
+            with self._cond:
+                if usable:
+                    self._stats['reused'] += 1
+                    note('conn', 'reused')
+                    return conn
+                self._in_use -= 1
+                self._discard(conn)
+                self._cond.notify()
+
+    def putconn(self, conn: Any) -> None:
+        keep = not conn.closed
+        if keep:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._stats, idle=len(self._idle), in_use=self._in_use)
+
+    def closeall(self) -> None:
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def _connect(self) -> Any:
+        try:
+            with phase('connect'):
+                conn = psycopg2.connect(self.dsn, cursor_factory=TimedCursor if TIMING_ENABLED else None)
+                if self.read_only:
+                    conn.set_session(readonly=True)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['opened'] += 1
+        note('conn', 'opened')
+        return conn
+
+    def _is_usable(self, conn: Any, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        idle_for = time.monotonic() - last_used
+        if idle_for > self.max_idle:
+            return False
+        if idle_for > self.ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _discard(self, conn: Any) -> None:
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class ReadRouter:
+    '''
+    Pool interface for side-effect-free queries. Connections come from the
+    replica pool when one is configured and from the primary otherwise, or
+    when the replica cannot hand out a connection. Replica sessions are
+    read-only, so a write routed here by mistake fails instead of diverging.
+    '''
+
+    def __init__(self, primary: ConnectionPool, replica: Optional[ConnectionPool]):
+        self.primary = primary
+        self.replica = replica
+        self._lock = threading.Lock()
+        self._from_replica: Set[int] = set()
+        self._routed = {'replica': 0, 'primary': 0, 'fallback': 0}
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self._routed[route] += 1
+        note('db_route', route)
+
+    def getconn(self) -> Any:
+        if self.replica is not None:
+            try:
+                conn = self.replica.getconn()
+            except (psycopg2.OperationalError, PoolExhausted):
+                self._count('fallback')
+            else:
+                with self._lock:
+                    self._from_replica.add(id(conn))
+                self._count('replica')
+                return conn
+        else:
+            self._count('primary')
+        return self.primary.getconn()
+
+    def putconn(self, conn: Any) -> None:
+        with self._lock:
+            from_replica = id(conn) in self._from_replica
+            self._from_replica.discard(id(conn))
+        (self.replica if from_replica else self.primary).putconn(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {'routed': dict(self._routed)}
+        if self.replica is not None:
+            result['replica'] = self.replica.stats()
+        return result
+
+    def closeall(self) -> None:
+        if self.replica is not None:
+            self.replica.closeall()
+
+
+_pool: Optional[ConnectionPool] = None
+_read_pool: Optional[ReadRouter] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def get_read_pool() -> ReadRouter:
+    '''
+    Pool for queries that neither write nor need to see this request's own
+    writes; everything else stays on get_pool()
+    '''
+    global _read_pool
+    if _read_pool is None:
+        primary = get_pool()
+        with _pool_lock:
+            if _read_pool is None:
+                read_dsn = os.environ.get('DATABASE_READ_URL')
+                replica = ConnectionPool(read_dsn, read_only=True) if read_dsn else None
+                _read_pool = ReadRouter(primary, replica)
+    return _read_pool
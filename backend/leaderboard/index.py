@@ -0,0 +1,73 @@
+from typing import Dict, Any
+
+from db import get_read_pool
+from ranking import LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_SIZE, RANK_SQL, find_entry, leaderboard
+from responses import error_response, json_response, preflight_response
+from statements import statements
+from timing import instrumented
+
+LEADERBOARD_TOP_DEFAULT = 10
+
+USER_RANK = statements.register('leaderboard_user_rank', RANK_SQL, ('integer',))
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Balance leaderboard - top users and the rank of one user
+    Args: event with httpMethod GET, query with optional limit and user_id
+    Returns: HTTP response with the top entries and, for user_id, that user's rank;
+    balances are spendable, ranks use folded balances as of the last refresh
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return preflight_response()
+    
+    if method != 'GET':
+        return error_response(405, 'Method not allowed')
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        limit = int(params.get('limit') or LEADERBOARD_TOP_DEFAULT)
+        user_id = int(params['user_id']) if params.get('user_id') else None
+    except ValueError:
+        return error_response(400, 'limit and user_id must be integers')
+    
+    if limit < 1 or limit > LEADERBOARD_SIZE:
+        return error_response(400, f'limit must be 1-{LEADERBOARD_SIZE}')
+    
+    entries = leaderboard.fresh()
+    mine = find_entry(entries, user_id) if entries is not None and user_id is not None else None
+    
+    if entries is None or (user_id is not None and mine is None):
+        pool = get_read_pool()
+        conn = pool.getconn()
+        cur = conn.cursor()
+        try:
+            if entries is None:
+                entries = leaderboard.load(cur)
+                mine = find_entry(entries, user_id) if user_id is not None else None
+            if user_id is not None and mine is None:
+                statements.execute(cur, USER_RANK, (user_id,))
+                row = cur.fetchone()
+                if not row:
+                    return error_response(404, 'User not found')
+                balance, ranked, bucket, ahead_in_bucket = row
+                rank = leaderboard.users_above(bucket) + ahead_in_bucket + 1 if ranked else None
+                mine = (rank, user_id, None, balance)
+        finally:
+            cur.close()
+            pool.putconn(conn)
+    
+    result: Dict[str, Any] = {
+        'top': [
+            {'rank': rank, 'user_id': uid, 'username': username, 'balance': balance}
+            for rank, uid, username, balance in entries[:limit]
+        ]
+    }
+    
+    if user_id is None:
+        return json_response(200, result, {'Cache-Control': f'public, max-age={int(LEADERBOARD_REFRESH_SECONDS)}'})
+    
+    result['me'] = {'user_id': user_id, 'rank': mine[0], 'balance': mine[3]}
+    return json_response(200, result, {'Cache-Control': 'private, no-cache'})
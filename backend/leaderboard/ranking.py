@@ -0,0 +1,107 @@
+'''
+In-process snapshot of the top of the balance leaderboard and of the
+per-bucket user counts (V0015). The snapshot is re-read at most once per
+LEADERBOARD_REFRESH_SECONDS, so repeated reads never touch the database, and
+the rank of a user outside the top only counts the users of their own bucket.
+Users are ranked by users.balance, which holds folded ledger credits only
+(the credit paths and compact_ledger fold them); the balances shown are the
+spendable ones, balance + pending_coins(id).
+'''
+import bisect
+import os
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from timing import note
+
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '100'))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '5'))
+
+# Both queries repeat the predicate of idx_users_leaderboard so that the
+# planner can use the partial index.
+RANKED_USERS = 'is_banned IS NOT TRUE AND balance IS NOT NULL'
+
+TOP_SQL = f'''
+    SELECT id, username, balance, balance + pending_coins(id) FROM users
+    WHERE {RANKED_USERS} ORDER BY balance DESC, id LIMIT %s
+'''
+
+BUCKETS_SQL = 'SELECT bucket, sum(users) FROM leaderboard_buckets GROUP BY bucket HAVING sum(users) <> 0'
+
+# Competition ranking: users with equal balances share a rank. Users in higher
+# buckets come from the snapshot; the count covers only the user's own bucket,
+# a range of idx_users_leaderboard no wider than the bucket (1% of the balance).
+RANK_SQL = '''
+    SELECT u.balance + pending_coins(u.id), u.is_banned IS NOT TRUE AND u.balance IS NOT NULL,
+           leaderboard_bucket(u.balance),
+           (SELECT count(*) FROM users o
+            WHERE o.is_banned IS NOT TRUE AND o.balance IS NOT NULL AND o.balance > u.balance
+              AND o.balance < leaderboard_bucket(u.balance) + leaderboard_bucket_width(u.balance))
+    FROM users u
+    WHERE u.id = $1
+'''
+
+Entry = Tuple[int, int, str, int]
+
+
+class LeaderboardSnapshot:
+    def __init__(self, size: int = LEADERBOARD_SIZE, refresh_after: float = LEADERBOARD_REFRESH_SECONDS):
+        self.size = size
+        self.refresh_after = refresh_after
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Entry]] = None
+        self._buckets: List[int] = []
+        self._users_from: List[int] = []
+        self._loaded_at = 0.0
+
+    def fresh(self) -> Optional[List[Entry]]:
+        '''
+        Returns the (rank, user_id, username, balance) entries when the
+        snapshot is still fresh, otherwise None
+        '''
+        with self._lock:
+            if self._entries is not None and time.monotonic() - self._loaded_at < self.refresh_after:
+                note('leaderboard', 'hit')
+                return self._entries
+        return None
+
+    def load(self, cur: Any) -> List[Entry]:
+        with self._lock:
+            if self._entries is not None and time.monotonic() - self._loaded_at < self.refresh_after:
+                return self._entries
+            note('leaderboard', 'refresh')
+            cur.execute(TOP_SQL, (self.size,))
+            entries: List[Entry] = []
+            previous = None
+            for position, (user_id, username, ranked_balance, balance) in enumerate(cur.fetchall(), 1):
+                rank = entries[-1][0] if entries and previous == ranked_balance else position
+                entries.append((rank, user_id, username, balance))
+                previous = ranked_balance
+            cur.execute(BUCKETS_SQL)
+            buckets = sorted(cur.fetchall())
+            users_from = [0] * (len(buckets) + 1)
+            for i in range(len(buckets) - 1, -1, -1):
+                users_from[i] = users_from[i + 1] + int(buckets[i][1])
+            self._entries = entries
+            self._buckets = [bucket for bucket, _ in buckets]
+            self._users_from = users_from
+            self._loaded_at = time.monotonic()
+            return entries
+
+    def users_above(self, bucket: int) -> int:
+        '''
+        Number of ranked users in buckets above bucket, as of the last load
+        '''
+        with self._lock:
+            return self._users_from[bisect.bisect_right(self._buckets, bucket)] if self._buckets else 0
+
+
+def find_entry(entries: List[Entry], user_id: int) -> Optional[Entry]:
+    for entry in entries:
+        if entry[1] == user_id:
+            return entry
+    return None
+
+
+leaderboard = LeaderboardSnapshot()
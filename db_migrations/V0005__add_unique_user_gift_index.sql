@@ -0,0 +1,9 @@
+-- Удаляем дубликаты покупок, оставляя самую раннюю запись
+DELETE FROM user_gifts a
+USING user_gifts b
+WHERE a.user_id = b.user_id
+  AND a.gift_id = b.gift_id
+  AND a.id > b.id;
+
+-- Один и тот же подарок можно купить только один раз
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_gifts_user_gift ON user_gifts(user_id, gift_id);
@@ -0,0 +1,2 @@
+-- Индекс для поиска пользователей по префиксу имени в админке
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (username varchar_pattern_ops);
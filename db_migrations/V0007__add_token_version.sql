@@ -0,0 +1,3 @@
+-- Версия сессии пользователя: увеличивается при бане и смене прав,
+-- после чего старые токены нельзя обновить
+ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,8 @@
+-- Версия каталога подарков: увеличивается при каждом изменении,
+-- по ней функция gifts сбрасывает закешированный каталог
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
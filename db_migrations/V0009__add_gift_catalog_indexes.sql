@@ -0,0 +1,3 @@
+-- Индексы для фильтрации каталога подарков по категории и цене и постраничной выдачи по цене
+CREATE INDEX IF NOT EXISTS idx_gifts_category_price ON gifts (category, price, id);
+CREATE INDEX IF NOT EXISTS idx_gifts_price ON gifts (price, id);
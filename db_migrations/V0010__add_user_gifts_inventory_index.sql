@@ -0,0 +1,3 @@
+-- Индекс для постраничной выдачи инвентаря пользователя по дате покупки
+-- (индекс по (user_id, gift_id) уже создан в V0005)
+CREATE INDEX IF NOT EXISTS idx_user_gifts_user_purchased ON user_gifts (user_id, purchased_at, id);
@@ -0,0 +1,4 @@
+-- Индекс для таблицы лидеров: топ по балансу и место пользователя
+-- читаются по индексу, без сортировки всей таблицы users
+CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users (balance DESC, id)
+    WHERE is_banned IS NOT TRUE AND balance IS NOT NULL;
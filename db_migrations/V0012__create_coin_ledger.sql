@@ -0,0 +1,23 @@
+-- Журнал движения монет. Начисления (ежедневный бонус, выдача админом)
+-- только добавляют строки с compacted = FALSE и не трогают users.balance;
+-- доступный баланс = users.balance + pending_coins(id). Списания и свёртка
+-- переносят ожидающие начисления в users.balance и помечают их compacted
+CREATE TABLE IF NOT EXISTS coin_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    delta INTEGER NOT NULL,
+    reason VARCHAR(32) NOT NULL,
+    compacted BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_coin_ledger_user ON coin_ledger (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_coin_ledger_pending ON coin_ledger (user_id) INCLUDE (delta) WHERE NOT compacted;
+
+CREATE OR REPLACE FUNCTION pending_coins(uid INTEGER) RETURNS BIGINT AS $$
+    SELECT COALESCE(sum(delta), 0) FROM coin_ledger WHERE user_id = uid AND NOT compacted
+$$ LANGUAGE sql STABLE;
+
+-- Начальные остатки, чтобы сумма журнала по пользователю совпадала с балансом
+INSERT INTO coin_ledger (user_id, delta, reason, compacted)
+SELECT id, COALESCE(balance, 0), 'opening_balance', TRUE FROM users;
@@ -0,0 +1,106 @@
+-- Счётчики для статистики админки. Их обновляют триггеры при регистрации,
+-- бане, выдаче прав, покупке, получении бонуса и любой записи в журнал монет,
+-- поэтому статистика читается без полного сканирования таблиц.
+-- Каждый счётчик разбит на 16 шардов по pg_backend_pid(): параллельные
+-- соединения увеличивают разные строки и не ждут блокировок друг друга
+CREATE TABLE IF NOT EXISTS stat_counters (
+    metric VARCHAR(32) NOT NULL,
+    shard SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, shard)
+);
+
+CREATE TABLE IF NOT EXISTS gift_purchase_counts (
+    gift_id INTEGER NOT NULL,
+    shard SMALLINT NOT NULL,
+    purchases BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (gift_id, shard)
+);
+
+CREATE TABLE IF NOT EXISTS daily_claim_counts (
+    claim_date DATE NOT NULL,
+    shard SMALLINT NOT NULL,
+    claims BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (claim_date, shard)
+);
+
+CREATE OR REPLACE FUNCTION bump_stat(name VARCHAR, delta BIGINT) RETURNS VOID AS $$
+    INSERT INTO stat_counters (metric, shard, value) VALUES (name, pg_backend_pid() % 16, delta)
+    ON CONFLICT (metric, shard) DO UPDATE SET value = stat_counters.value + EXCLUDED.value
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION count_users() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_stat('users', 1);
+        PERFORM bump_stat('banned_users', 1) WHERE NEW.is_banned IS TRUE;
+        PERFORM bump_stat('admin_users', 1) WHERE NEW.is_admin IS TRUE;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bump_stat('users', -1);
+        PERFORM bump_stat('banned_users', -1) WHERE OLD.is_banned IS TRUE;
+        PERFORM bump_stat('admin_users', -1) WHERE OLD.is_admin IS TRUE;
+    ELSE
+        PERFORM bump_stat('banned_users', CASE WHEN NEW.is_banned IS TRUE THEN 1 ELSE -1 END)
+        WHERE (NEW.is_banned IS TRUE) <> (OLD.is_banned IS TRUE);
+        PERFORM bump_stat('admin_users', CASE WHEN NEW.is_admin IS TRUE THEN 1 ELSE -1 END)
+        WHERE (NEW.is_admin IS TRUE) <> (OLD.is_admin IS TRUE);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_coins() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_stat('coins', NEW.delta);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_purchases() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO gift_purchase_counts (gift_id, shard, purchases) VALUES (NEW.gift_id, pg_backend_pid() % 16, 1)
+    ON CONFLICT (gift_id, shard) DO UPDATE SET purchases = gift_purchase_counts.purchases + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_claims() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO daily_claim_counts (claim_date, shard, claims) VALUES (NEW.last_claim_date, pg_backend_pid() % 16, 1)
+    ON CONFLICT (claim_date, shard) DO UPDATE SET claims = daily_claim_counts.claims + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_count_users ON users;
+CREATE TRIGGER trg_count_users AFTER INSERT OR DELETE OR UPDATE OF is_banned, is_admin ON users
+    FOR EACH ROW EXECUTE FUNCTION count_users();
+
+DROP TRIGGER IF EXISTS trg_count_coins ON coin_ledger;
+CREATE TRIGGER trg_count_coins AFTER INSERT ON coin_ledger
+    FOR EACH ROW EXECUTE FUNCTION count_coins();
+
+DROP TRIGGER IF EXISTS trg_count_purchases ON user_gifts;
+CREATE TRIGGER trg_count_purchases AFTER INSERT ON user_gifts
+    FOR EACH ROW EXECUTE FUNCTION count_purchases();
+
+DROP TRIGGER IF EXISTS trg_count_claims ON daily_rewards;
+CREATE TRIGGER trg_count_claims AFTER INSERT OR UPDATE OF last_claim_date ON daily_rewards
+    FOR EACH ROW EXECUTE FUNCTION count_claims();
+
+-- Начальные значения по текущим данным (по бонусам известна только дата
+-- последнего получения, более ранние дни не восстановить)
+INSERT INTO stat_counters (metric, shard, value)
+SELECT 'users', 0, count(*) FROM users
+UNION ALL SELECT 'banned_users', 0, count(*) FILTER (WHERE is_banned IS TRUE) FROM users
+UNION ALL SELECT 'admin_users', 0, count(*) FILTER (WHERE is_admin IS TRUE) FROM users
+UNION ALL SELECT 'coins', 0, COALESCE(sum(delta), 0) FROM coin_ledger
+ON CONFLICT (metric, shard) DO NOTHING;
+
+INSERT INTO gift_purchase_counts (gift_id, shard, purchases)
+SELECT gift_id, 0, count(*) FROM user_gifts WHERE gift_id IS NOT NULL GROUP BY gift_id
+ON CONFLICT (gift_id, shard) DO NOTHING;
+
+INSERT INTO daily_claim_counts (claim_date, shard, claims)
+SELECT last_claim_date, 0, count(*) FROM daily_rewards GROUP BY last_claim_date
+ON CONFLICT (claim_date, shard) DO NOTHING;
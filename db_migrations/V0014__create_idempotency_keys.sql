@@ -0,0 +1,14 @@
+-- Ключи идемпотентности для повторных POST-запросов (покупка, бонус, выдача
+-- монет): ключ сохраняется вместе с ответом в той же транзакции, что и сама
+-- операция; повтор с тем же ключом получает сохранённый ответ
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(32) NOT NULL,
+    key VARCHAR(128) NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    status SMALLINT NOT NULL,
+    body TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);
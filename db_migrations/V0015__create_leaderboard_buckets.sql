@@ -0,0 +1,78 @@
+-- Счётчики пользователей по корзинам баланса для места в таблице лидеров.
+-- Корзина - баланс, округлённый вниз до двух значащих цифр (1234 -> 1200,
+-- 56789 -> 56000, до 100 - сам баланс), поэтому корзин немного при любом
+-- числе пользователей. Место = пользователи в корзинах выше + пользователи
+-- своей корзины с большим балансом; второе - короткий диапазон индекса
+-- idx_users_leaderboard, а не подсчёт всех, кто выше.
+-- Триггеры на users поддерживают счётчики; как и stat_counters, они разбиты
+-- на 16 шардов по pg_backend_pid()
+CREATE TABLE IF NOT EXISTS leaderboard_buckets (
+    bucket BIGINT NOT NULL,
+    shard SMALLINT NOT NULL,
+    users BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, shard)
+);
+
+CREATE OR REPLACE FUNCTION leaderboard_bucket_width(balance BIGINT) RETURNS BIGINT AS $$
+    SELECT CASE WHEN balance < 100 THEN 1 ELSE (10 ^ (length(balance::text) - 2))::bigint END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION leaderboard_bucket(balance BIGINT) RETURNS BIGINT AS $$
+    SELECT balance - balance % leaderboard_bucket_width(balance)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Триггеры уровня оператора с таблицами переходов: один оператор (свёртка
+-- журнала, массовые операции) обновляет каждую корзину одной строкой, а не
+-- по разу на каждого пользователя
+CREATE OR REPLACE FUNCTION count_leaderboard() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO leaderboard_buckets (bucket, shard, users)
+        SELECT leaderboard_bucket(balance), pg_backend_pid() % 16, count(*) FROM new_rows
+        WHERE is_banned IS NOT TRUE AND balance IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (bucket, shard) DO UPDATE SET users = leaderboard_buckets.users + EXCLUDED.users;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO leaderboard_buckets (bucket, shard, users)
+        SELECT leaderboard_bucket(balance), pg_backend_pid() % 16, -count(*) FROM old_rows
+        WHERE is_banned IS NOT TRUE AND balance IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (bucket, shard) DO UPDATE SET users = leaderboard_buckets.users + EXCLUDED.users;
+    ELSE
+        INSERT INTO leaderboard_buckets (bucket, shard, users)
+        SELECT bucket, pg_backend_pid() % 16, sum(delta) FROM (
+            SELECT leaderboard_bucket(balance) AS bucket, -1 AS delta FROM old_rows
+            WHERE is_banned IS NOT TRUE AND balance IS NOT NULL
+            UNION ALL
+            SELECT leaderboard_bucket(balance), 1 FROM new_rows
+            WHERE is_banned IS NOT TRUE AND balance IS NOT NULL
+        ) changes
+        GROUP BY bucket
+        HAVING sum(delta) <> 0
+        ON CONFLICT (bucket, shard) DO UPDATE SET users = leaderboard_buckets.users + EXCLUDED.users;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_count_leaderboard_insert ON users;
+CREATE TRIGGER trg_count_leaderboard_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_leaderboard();
+
+DROP TRIGGER IF EXISTS trg_count_leaderboard_update ON users;
+CREATE TRIGGER trg_count_leaderboard_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_leaderboard();
+
+DROP TRIGGER IF EXISTS trg_count_leaderboard_delete ON users;
+CREATE TRIGGER trg_count_leaderboard_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_leaderboard();
+
+-- Начальные значения по текущим балансам
+INSERT INTO leaderboard_buckets (bucket, shard, users)
+SELECT leaderboard_bucket(balance), 0, count(*) FROM users
+WHERE is_banned IS NOT TRUE AND balance IS NOT NULL
+GROUP BY 1
+ON CONFLICT (bucket, shard) DO NOTHING;
@@ -0,0 +1,101 @@
+-- Триггеры счётчиков статистики (V0013) срабатывали на каждую строку: оператор,
+-- меняющий тысячи строк (массовые операции админки, начисления пачкой,
+-- импорт), тысячи раз обновлял одну и ту же строку шарда в одной транзакции,
+-- и время росло квадратично. Теперь это триггеры уровня оператора с таблицами
+-- переходов: одна запись на метрику, подарок или день за оператор
+CREATE OR REPLACE FUNCTION count_users() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_stat(metric, n) FROM (
+            SELECT 'users' AS metric, count(*) AS n FROM new_rows
+            UNION ALL SELECT 'banned_users', count(*) FILTER (WHERE is_banned IS TRUE) FROM new_rows
+            UNION ALL SELECT 'admin_users', count(*) FILTER (WHERE is_admin IS TRUE) FROM new_rows
+        ) changes WHERE n <> 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bump_stat(metric, -n) FROM (
+            SELECT 'users' AS metric, count(*) AS n FROM old_rows
+            UNION ALL SELECT 'banned_users', count(*) FILTER (WHERE is_banned IS TRUE) FROM old_rows
+            UNION ALL SELECT 'admin_users', count(*) FILTER (WHERE is_admin IS TRUE) FROM old_rows
+        ) changes WHERE n <> 0;
+    ELSE
+        PERFORM bump_stat(metric, n) FROM (
+            SELECT 'banned_users' AS metric,
+                   (SELECT count(*) FROM new_rows WHERE is_banned IS TRUE)
+                   - (SELECT count(*) FROM old_rows WHERE is_banned IS TRUE) AS n
+            UNION ALL
+            SELECT 'admin_users',
+                   (SELECT count(*) FROM new_rows WHERE is_admin IS TRUE)
+                   - (SELECT count(*) FROM old_rows WHERE is_admin IS TRUE)
+        ) changes WHERE n <> 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_coins() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_stat('coins', total) FROM (SELECT sum(delta) AS total FROM new_rows) changes WHERE total <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_purchases() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO gift_purchase_counts (gift_id, shard, purchases)
+    SELECT gift_id, pg_backend_pid() % 16, count(*) FROM new_rows WHERE gift_id IS NOT NULL GROUP BY gift_id
+    ON CONFLICT (gift_id, shard) DO UPDATE SET purchases = gift_purchase_counts.purchases + EXCLUDED.purchases;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_claims() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO daily_claim_counts (claim_date, shard, claims)
+        SELECT last_claim_date, pg_backend_pid() % 16, count(*) FROM new_rows GROUP BY last_claim_date
+        ON CONFLICT (claim_date, shard) DO UPDATE SET claims = daily_claim_counts.claims + EXCLUDED.claims;
+    ELSE
+        INSERT INTO daily_claim_counts (claim_date, shard, claims)
+        SELECT n.last_claim_date, pg_backend_pid() % 16, count(*)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.last_claim_date IS DISTINCT FROM o.last_claim_date
+        GROUP BY n.last_claim_date
+        ON CONFLICT (claim_date, shard) DO UPDATE SET claims = daily_claim_counts.claims + EXCLUDED.claims;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_count_users ON users;
+DROP TRIGGER IF EXISTS trg_count_users_insert ON users;
+CREATE TRIGGER trg_count_users_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+DROP TRIGGER IF EXISTS trg_count_users_update ON users;
+CREATE TRIGGER trg_count_users_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+DROP TRIGGER IF EXISTS trg_count_users_delete ON users;
+CREATE TRIGGER trg_count_users_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+
+DROP TRIGGER IF EXISTS trg_count_coins ON coin_ledger;
+CREATE TRIGGER trg_count_coins AFTER INSERT ON coin_ledger
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_coins();
+
+DROP TRIGGER IF EXISTS trg_count_purchases ON user_gifts;
+CREATE TRIGGER trg_count_purchases AFTER INSERT ON user_gifts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_purchases();
+
+DROP TRIGGER IF EXISTS trg_count_claims ON daily_rewards;
+DROP TRIGGER IF EXISTS trg_count_claims_insert ON daily_rewards;
+CREATE TRIGGER trg_count_claims_insert AFTER INSERT ON daily_rewards
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_claims();
+DROP TRIGGER IF EXISTS trg_count_claims_update ON daily_rewards;
+CREATE TRIGGER trg_count_claims_update AFTER UPDATE ON daily_rewards
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION count_claims();
@@ -0,0 +1,27 @@
+import { useCallback, useRef } from 'react';
+
+// One Idempotency-Key per logical operation (a claim, a purchase of one gift,
+// a grant of an amount to one user). Double-submits and retries of the same
+// operation reuse its key, so the server runs it once and replays the answer.
+export const useIdempotencyKeys = () => {
+  const keys = useRef(new Map<string, string>());
+
+  const keyFor = useCallback((operation: string) => {
+    let key = keys.current.get(operation);
+    if (!key) {
+      key = crypto.randomUUID();
+      keys.current.set(operation, key);
+    }
+    return key;
+  }, []);
+
+  // Forget the key once the server answered definitively. A network error or
+  // a 5xx leaves the outcome unknown, so the retry must send the same key.
+  const settle = useCallback((operation: string, response: Response) => {
+    if (response.status < 500) {
+      keys.current.delete(operation);
+    }
+  }, []);
+
+  return { keyFor, settle };
+};
@@ -4,23 +4,84 @@ import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { useToast } from '@/hooks/use-toast';
+import { useIdempotencyKeys } from '@/hooks/use-idempotency-keys';
 import Icon from '@/components/ui/icon';
 
 interface User {
   id: number;
   username: string;
-  password: string;
   balance: number;
   is_admin: boolean;
   is_banned: boolean;
   created_at: string;
 }
 
+const AUTH_URL = 'https://functions.poehali.dev/1d67167c-a8f9-4d41-b8dc-b5390a22bb25';
+const TOKEN_REFRESH_MARGIN_SECONDS = 60;
+
+const tokenExpiry = (token: string): number => {
+  try {
+    return JSON.parse(atob(token.split('.')[0].replace(/-/g, '+').replace(/_/g, '/'))).exp || 0;
+  } catch {
+    return 0;
+  }
+};
+
+let refreshing: Promise<string> | null = null;
+
+const refreshToken = async (token: string): Promise<string> => {
+  try {
+    const response = await fetch(AUTH_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'refresh', token }),
+    });
+    const data = await response.json();
+    if (data.token) {
+      localStorage.setItem('token', data.token);
+      return data.token;
+    }
+    if (response.status === 401 || response.status === 403) {
+      localStorage.removeItem('token');
+      return '';
+    }
+  } catch (error) {
+    console.error('Failed to refresh session token:', error);
+  }
+  return token;
+};
+
+// Session tokens expire after 15 minutes. Renewing one shortly before that
+// keeps admin calls authorized from its claims, without a database lookup.
+const freshToken = async (): Promise<string> => {
+  const token = localStorage.getItem('token') || '';
+  if (!token || tokenExpiry(token) - Date.now() / 1000 > TOKEN_REFRESH_MARGIN_SECONDS) {
+    return token;
+  }
+  refreshing = refreshing || refreshToken(token).finally(() => {
+    refreshing = null;
+  });
+  return refreshing;
+};
+
+const authHeaders = async () => ({
+  'Content-Type': 'application/json',
+  'X-Auth-Token': await freshToken(),
+});
+
+interface Stats {
+  users: { total: number; banned: number; admins: number };
+  coins_in_circulation: number;
+}
+
 const Admin = () => {
   const navigate = useNavigate();
   const { toast } = useToast();
+  const { keyFor, settle } = useIdempotencyKeys();
   const [currentUser, setCurrentUser] = useState<any>(null);
   const [users, setUsers] = useState<User[]>([]);
+  const [nextCursor, setNextCursor] = useState<number | null>(null);
+  const [stats, setStats] = useState<Stats | null>(null);
   const [loading, setLoading] = useState(false);
   const [selectedUser, setSelectedUser] = useState<string>('');
   const [coinsAmount, setCoinsAmount] = useState<number>(0);
@@ -52,12 +113,15 @@ const Admin = () => {
   const checkAdminStatus = async (username: string) => {
     try {
       const response = await fetch(
-        `https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3?admin_username=${username}`
+        `https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3?admin_username=${username}`,
+        { headers: await authHeaders() }
       );
       const data = await response.json();
       
       if (response.ok) {
         setUsers(data.users || []);
+        setNextCursor(data.next_cursor ?? null);
+        loadStats(username);
       } else {
         toast({
           title: 'Доступ запрещен',
@@ -76,16 +140,36 @@ const Admin = () => {
     }
   };
 
-  const loadUsers = async (adminUsername: string) => {
+  const loadStats = async (adminUsername: string) => {
+    try {
+      const response = await fetch(
+        `https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3?admin_username=${adminUsername}&action=stats`,
+        { headers: await authHeaders() }
+      );
+      if (response.ok) {
+        setStats(await response.json());
+      }
+    } catch (error) {
+      console.error('Failed to load stats:', error);
+    }
+  };
+
+  const loadUsers = async (adminUsername: string, afterId?: number) => {
     setLoading(true);
     try {
+      const cursor = afterId ? `&after_id=${afterId}` : '';
       const response = await fetch(
-        `https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3?admin_username=${adminUsername}`
+        `https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3?admin_username=${adminUsername}${cursor}`,
+        { headers: await authHeaders() }
       );
       const data = await response.json();
       
       if (response.ok) {
-        setUsers(data.users || []);
+        setUsers(prev => afterId ? [...prev, ...(data.users || [])] : (data.users || []));
+        setNextCursor(data.next_cursor ?? null);
+        if (!afterId) {
+          loadStats(adminUsername);
+        }
       } else {
         toast({
           title: 'Ошибка',
@@ -113,11 +197,12 @@ const Admin = () => {
       return;
     }
 
+    const operation = `add_coins:${targetUsername}:${coinsAmount}`;
     setLoading(true);
     try {
       const response = await fetch('https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { ...(await authHeaders()), 'Idempotency-Key': keyFor(operation) },
         body: JSON.stringify({
           action: 'add_coins',
           admin_username: currentUser.username,
@@ -125,6 +210,7 @@ const Admin = () => {
           coins: coinsAmount,
         }),
       });
+      settle(operation, response);
 
       const data = await response.json();
 
@@ -158,7 +244,7 @@ const Admin = () => {
     try {
       const response = await fetch('https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders(),
         body: JSON.stringify({
           action: 'ban_user',
           admin_username: currentUser.username,
@@ -197,7 +283,7 @@ const Admin = () => {
     try {
       const response = await fetch('https://functions.poehali.dev/6435b3ae-872c-4ca5-8130-750f684077c3', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders(),
         body: JSON.stringify({
           action: 'grant_admin',
           admin_username: currentUser.username,
@@ -245,7 +331,7 @@ const Admin = () => {
     try {
       const response = await fetch('https://functions.poehali.dev/e3cff682-44c4-4ca5-a1dc-cf7aed0b0fce', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders(),
         body: JSON.stringify({
           action: 'add_gift',
           admin_username: currentUser.username,
@@ -311,7 +397,7 @@ const Admin = () => {
             <div className="flex items-center gap-4">
               <Icon name="Users" size={48} className="text-graffiti-purple" />
               <div>
-                <div className="text-4xl font-black text-white">{users.length}</div>
+                <div className="text-4xl font-black text-white">{stats ? stats.users.total : users.length}</div>
                 <div className="text-white/60">Всего пользователей</div>
               </div>
             </div>
@@ -322,7 +408,7 @@ const Admin = () => {
               <Icon name="ShieldCheck" size={48} className="text-graffiti-pink" />
               <div>
                 <div className="text-4xl font-black text-white">
-                  {users.filter(u => u.is_admin).length}
+                  {stats ? stats.users.admins : users.filter(u => u.is_admin).length}
                 </div>
                 <div className="text-white/60">Администраторов</div>
               </div>
@@ -334,7 +420,7 @@ const Admin = () => {
               <Icon name="Ban" size={48} className="text-graffiti-orange" />
               <div>
                 <div className="text-4xl font-black text-white">
-                  {users.filter(u => u.is_banned).length}
+                  {stats ? stats.users.banned : users.filter(u => u.is_banned).length}
                 </div>
                 <div className="text-white/60">Заблокировано</div>
               </div>
@@ -437,7 +523,6 @@ const Admin = () => {
                 <tr className="border-b border-graffiti-purple/30">
                   <th className="text-left p-3">ID</th>
                   <th className="text-left p-3">Ник</th>
-                  <th className="text-left p-3">Пароль (хеш)</th>
                   <th className="text-left p-3">Баланс</th>
                   <th className="text-left p-3">Дата</th>
                   <th className="text-center p-3">Админ</th>
@@ -450,9 +535,6 @@ const Admin = () => {
                   <tr key={user.id} className="border-b border-graffiti-purple/10 hover:bg-graffiti-purple/5">
                     <td className="p-3">{user.id}</td>
                     <td className="p-3 font-bold">{user.username}</td>
-                    <td className="p-3 text-xs font-mono text-white/60 max-w-xs truncate">
-                      {user.password}
-                    </td>
                     <td className="p-3">
                       <span className="text-graffiti-electric font-bold">{user.balance}₡</span>
                     </td>
@@ -498,6 +580,17 @@ const Admin = () => {
               </tbody>
             </table>
           </div>
+          {nextCursor !== null && (
+            <Button
+              onClick={() => loadUsers(currentUser.username, nextCursor)}
+              disabled={loading}
+              variant="outline"
+              className="w-full mt-4"
+            >
+              <Icon name="ChevronDown" size={20} className="mr-2" />
+              Загрузить ещё
+            </Button>
+          )}
         </Card>
       </div>
     </div>
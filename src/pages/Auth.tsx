@@ -33,6 +33,9 @@ const Auth = () => {
 
       if (data.success) {
         localStorage.setItem('user', JSON.stringify(data.user));
+        if (data.token) {
+          localStorage.setItem('token', data.token);
+        }
         toast({
           title: isLogin ? 'Вход выполнен!' : 'Регистрация успешна!',
           description: `Добро пожаловать, ${data.user.username}!`,
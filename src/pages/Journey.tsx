@@ -3,6 +3,7 @@ import { Link, useNavigate } from 'react-router-dom';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { useToast } from '@/hooks/use-toast';
+import { useIdempotencyKeys } from '@/hooks/use-idempotency-keys';
 import Icon from '@/components/ui/icon';
 
 interface User {
@@ -24,6 +25,7 @@ interface Gift {
 const Journey = () => {
   const navigate = useNavigate();
   const { toast } = useToast();
+  const { keyFor, settle } = useIdempotencyKeys();
   const [user, setUser] = useState<User | null>(null);
   const [gifts, setGifts] = useState<Gift[]>([]);
   const [loading, setLoading] = useState(false);
@@ -53,13 +55,15 @@ const Journey = () => {
   const handleClaimDaily = async () => {
     if (!user) return;
     
+    const operation = `claim:${user.id}`;
     setLoading(true);
     try {
       const response = await fetch('https://functions.poehali.dev/fcce9959-1f1d-4a4f-ad61-3f2c31e54a0d', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': keyFor(operation) },
         body: JSON.stringify({ user_id: user.id }),
       });
+      settle(operation, response);
       
       const data = await response.json();
       
@@ -92,9 +96,25 @@ const Journey = () => {
 
   const loadGifts = async (userId: number) => {
     try {
-      const response = await fetch(`https://functions.poehali.dev/e3cff682-44c4-4ca5-a1dc-cf7aed0b0fce?user_id=${userId}`);
-      const data = await response.json();
-      setGifts(data.gifts || []);
+      const giftsUrl = 'https://functions.poehali.dev/e3cff682-44c4-4ca5-a1dc-cf7aed0b0fce';
+      const loadOwned = async () => {
+        const owned = new Set<number>();
+        let cursor: number | null = null;
+        do {
+          const response = await fetch(
+            `${giftsUrl}?action=inventory&user_id=${userId}&limit=500${cursor ? `&cursor=${cursor}` : ''}`
+          );
+          const data = await response.json();
+          (data.items || []).forEach((item: { gift_id: number }) => owned.add(item.gift_id));
+          cursor = data.next_cursor ?? null;
+        } while (cursor);
+        return owned;
+      };
+      const [catalog, owned] = await Promise.all([
+        fetch(giftsUrl).then((response) => response.json()),
+        loadOwned(),
+      ]);
+      setGifts((catalog.gifts || []).map((gift: Gift) => ({ ...gift, purchased: owned.has(gift.id) })));
     } catch (error) {
       console.error('Failed to load gifts:', error);
     }
@@ -120,13 +140,15 @@ const Journey = () => {
       return;
     }
 
+    const operation = `purchase:${user.id}:${giftId}`;
     setLoading(true);
     try {
       const response = await fetch('https://functions.poehali.dev/e3cff682-44c4-4ca5-a1dc-cf7aed0b0fce', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': keyFor(operation) },
         body: JSON.stringify({ user_id: user.id, gift_id: giftId }),
       });
+      settle(operation, response);
 
       const data = await response.json();
       if (data.success) {
@@ -158,6 +180,7 @@ const Journey = () => {
 
   const handleLogout = () => {
     localStorage.removeItem('user');
+    localStorage.removeItem('token');
     setUser(null);
     navigate('/auth');
   };
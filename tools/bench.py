@@ -0,0 +1,473 @@
+'''
+Benchmark and load-test runner for the backend functions against a local
+PostgreSQL. Workloads run through the in-process gateway (tools/gateway.py)
+or against a running gateway with --base-url.
+
+Workloads:
+    scenarios          replay every backend/*/tests.json scenario
+    login_storm        parallel logins of seeded users from many source IPs, 10% with a wrong password
+    purchase_race      one user buys many gifts (and duplicates) at once
+    daily_claim_spike  many parallel claims of the same user's daily reward
+    admin_listing      admin user pages, prefix searches and filters
+    leaderboard_rank   "my rank" of random seeded users spread over a wide balance range
+
+Usage:
+    DATABASE_URL=postgresql://... python tools/bench.py --seed-users 100000
+    python tools/bench.py --workloads login_storm,purchase_race --concurrency 32
+    python tools/bench.py --compare bench_results/<older>.json
+    python tools/bench.py --cold-start --compare bench_results/<older>.json
+
+Each run writes bench_results/<timestamp>-<commit>.json with throughput,
+p50/p95/p99 latency, status counts and queries per request for each handler
+(from the Server-Timing header, else pg_stat_statements),
+plus the consistency checks of the race workloads. With --cold-start it also
+records the tools/coldstart.py profile (import time, time to first query and
+to first response of a fresh process per function), which --compare then
+shows before/after as well.
+'''
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import coldstart  # noqa: E402
+from gateway import BACKEND_DIR, Gateway, build_event  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent.parent / 'bench_results'
+BENCH_PASSWORD = 'bench-password'
+BENCH_ADMIN = 'bench_admin'
+
+
+@dataclass
+class Request:
+    function: str
+    method: str
+    path: str = '/'
+    query: Optional[Dict[str, Any]] = None
+    body: Optional[Dict[str, Any]] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    expected_status: Optional[int] = None
+
+
+@dataclass
+class Sample:
+    function: str
+    status: int
+    seconds: float
+    expected: Optional[bool]
+    queries: Optional[int] = None
+
+
+def queries_from_server_timing(headers: Dict[str, str]) -> Optional[int]:
+    '''
+    Reads the query count that timing.py reports as db;desc="N queries"
+    '''
+    value = next((v for k, v in headers.items() if k.lower() == 'server-timing'), None)
+    if not value:
+        return None
+    for metric in value.split(','):
+        name, _, params = metric.strip().partition(';')
+        if name == 'db' and 'desc="' in params:
+            return int(params.split('desc="', 1)[1].split(' ', 1)[0])
+    return 0
+
+
+class InProcessClient:
+    def __init__(self, gateway: Gateway):
+        self.gateway = gateway
+
+    def call(self, req: Request) -> Tuple[int, Dict[str, str], str]:
+        body = json.dumps(req.body).encode('utf-8') if req.body is not None else b''
+        headers = {'Content-Type': 'application/json', **req.headers}
+        source_ip = req.headers.get('X-Forwarded-For', '127.0.0.1')
+        event = build_event(req.method, req.path, urlencode(req.query or {}), headers, body, source_ip)
+        response = self.gateway.invoke(req.function, event)
+        return response.get('statusCode', 200), response.get('headers') or {}, response.get('body') or ''
+
+
+class HttpClient:
+    '''
+    Talks to a running gateway, keeping one keep-alive connection per thread
+    '''
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def call(self, req: Request) -> Tuple[int, Dict[str, str], str]:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        path = f'/{req.function}{req.path}'
+        if req.query:
+            path += '?' + urlencode(req.query)
+        body = json.dumps(req.body) if req.body is not None else None
+        try:
+            conn.request(req.method, path, body=body, headers={'Content-Type': 'application/json', **req.headers})
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read().decode('utf-8')
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_load(client: Any, requests: List[Request], concurrency: int) -> Tuple[List[Sample], float]:
+    def one(req: Request) -> Sample:
+        started = time.perf_counter()
+        try:
+            status, headers, _ = client.call(req)
+        except Exception:
+            status, headers = 599, {}
+        elapsed = time.perf_counter() - started
+        expected = None if req.expected_status is None else status == req.expected_status
+        return Sample(req.function, status, elapsed, expected, queries_from_server_timing(headers))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one, requests))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: List[Sample], wall_seconds: float) -> Dict[str, Any]:
+    by_function: Dict[str, List[Sample]] = {}
+    for s in samples:
+        by_function.setdefault(s.function, []).append(s)
+
+    summary = {}
+    for function, items in by_function.items():
+        latencies = sorted(s.seconds * 1000 for s in items)
+        statuses: Dict[str, int] = {}
+        for s in items:
+            statuses[str(s.status)] = statuses.get(str(s.status), 0) + 1
+        checked = [s.expected for s in items if s.expected is not None]
+        counted = [s.queries for s in items if s.queries is not None]
+        summary[function] = {
+            'requests': len(items),
+            'throughput_rps': round(len(items) / wall_seconds, 1) if wall_seconds else None,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'errors': sum(1 for s in items if s.status >= 500),
+            'statuses': statuses,
+            'unexpected_status': len(checked) - sum(checked) if checked else 0,
+            'queries_per_request': round(sum(counted) / len(counted), 2) if counted else None
+        }
+    return summary
+
+
+class QueryCounter:
+    '''
+    Counts statements executed by the server between start() and stop() using
+    pg_stat_statements when the extension is installed
+    '''
+    SQL = "SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements WHERE query NOT LIKE '%pg_stat_statements%'"
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.available = True
+        self._start = 0
+
+    def _read(self) -> Optional[int]:
+        if not self.available:
+            return None
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(self.SQL)
+                return int(cur.fetchone()[0])
+        except psycopg2.Error:
+            self.available = False
+            return None
+
+    def start(self) -> None:
+        self._start = self._read() or 0
+
+    def stop(self) -> Optional[int]:
+        end = self._read()
+        return None if end is None else end - self._start
+
+
+class BenchContext:
+    def __init__(self, client: Any, conn: Any, concurrency: int, requests: int, seed_users: int):
+        self.client = client
+        self.conn = conn
+        self.concurrency = concurrency
+        self.requests = requests
+        self.seed_users = seed_users
+        self.run_id = f'{int(time.time())}{random.randint(100, 999)}'
+
+    def sql(self, query: str, params: Any = None, fetch: bool = False) -> Any:
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if fetch else None
+
+    def measure(self, requests: List[Request]) -> Tuple[Dict[str, Any], List[Sample]]:
+        counter = QueryCounter(self.conn)
+        counter.start()
+        samples, wall = run_load(self.client, requests, self.concurrency)
+        queries = counter.stop()
+        summary = summarize(samples, wall)
+        for stats in summary.values():
+            if stats['queries_per_request'] is None and queries is not None:
+                stats['queries_per_request'] = round(queries / len(samples), 2)
+        return {'wall_seconds': round(wall, 3), 'handlers': summary}, samples
+
+
+def seed(conn: Any, users: int) -> None:
+    '''
+    Idempotently creates bench_user_1..N sharing one bcrypt hash, plus an admin
+    '''
+    import bcrypt
+
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    with conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO users (username, password, balance)
+               SELECT 'bench_user_' || g, %s, 1000 FROM generate_series(1, %s) g
+               ON CONFLICT (username) DO NOTHING""",
+            (password_hash, users)
+        )
+        cur.execute(
+            """INSERT INTO users (username, password, balance, is_admin) VALUES (%s, %s, 1000, TRUE)
+               ON CONFLICT (username) DO UPDATE SET is_admin = TRUE, is_banned = FALSE""",
+            (BENCH_ADMIN, password_hash)
+        )
+
+
+def load_scenarios() -> List[Request]:
+    requests = []
+    for tests_path in sorted(BACKEND_DIR.glob('*/tests.json')):
+        for test in json.loads(tests_path.read_text(encoding='utf-8')).get('tests', []):
+            parts = urlsplit(test.get('path', '/'))
+            query = dict(parse_qsl(parts.query))
+            requests.append(Request(tests_path.parent.name, test['method'], parts.path or '/', query,
+                                    test.get('body'), expected_status=test.get('expectedStatus')))
+    return requests
+
+
+def workload_scenarios(ctx: BenchContext) -> Dict[str, Any]:
+    scenarios = load_scenarios()
+    repeats = max(1, ctx.requests // max(1, len(scenarios)))
+    result, _ = ctx.measure(scenarios * repeats)
+    return result
+
+
+def workload_login_storm(ctx: BenchContext) -> Dict[str, Any]:
+    requests = []
+    for _ in range(ctx.requests):
+        wrong = random.random() < 0.1
+        requests.append(Request('auth', 'POST', body={
+            'action': 'login',
+            'username': f'bench_user_{random.randint(1, ctx.seed_users)}',
+            'password': 'wrong-password' if wrong else BENCH_PASSWORD
+        }, headers={'X-Forwarded-For': f'10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}'},
+            expected_status=401 if wrong else 200))
+    result, _ = ctx.measure(requests)
+    return result
+
+
+def workload_purchase_race(ctx: BenchContext) -> Dict[str, Any]:
+    gifts, price, balance = 20, 100, 1000
+    ctx.sql("INSERT INTO users (username, password, balance) VALUES (%s, 'x', %s)",
+            (f'bench_race_{ctx.run_id}', balance))
+    user_id = ctx.sql("SELECT id FROM users WHERE username = %s", (f'bench_race_{ctx.run_id}',), fetch=True)[0][0]
+    gift_ids = [r[0] for r in ctx.sql(
+        """INSERT INTO gifts (name, description, price, icon, category)
+           SELECT 'bench_gift_' || %s || '_' || g, 'bench', %s, 'Gift', 'bench' FROM generate_series(1, %s) g
+           RETURNING id""", (ctx.run_id, price, gifts), fetch=True)]
+    ctx.sql("UPDATE catalog_version SET version = version + 1")
+
+    requests = [Request('gifts', 'POST', body={'user_id': user_id, 'gift_id': gid})
+                for gid in gift_ids for _ in range(3)]
+    random.shuffle(requests)
+    result, samples = ctx.measure(requests)
+
+    final_balance = ctx.sql("SELECT balance + pending_coins(id) FROM users WHERE id = %s", (user_id,), fetch=True)[0][0]
+    owned = ctx.sql("SELECT gift_id, COUNT(*) FROM user_gifts WHERE user_id = %s GROUP BY gift_id",
+                    (user_id,), fetch=True)
+    successes = sum(1 for s in samples if s.status == 200)
+    result['checks'] = {
+        'successful_purchases': successes,
+        'owned_gifts': len(owned),
+        'no_duplicate_ownership': all(count == 1 for _, count in owned),
+        'balance_consistent': final_balance == balance - price * len(owned),
+        'no_overdraft': final_balance >= 0,
+        'successes_match_rows': successes == len(owned)
+    }
+    return result
+
+
+def workload_daily_claim_spike(ctx: BenchContext) -> Dict[str, Any]:
+    username = f'bench_claim_{ctx.run_id}'
+    ctx.sql("INSERT INTO users (username, password, balance) VALUES (%s, 'x', 0)", (username,))
+    user_id = ctx.sql("SELECT id FROM users WHERE username = %s", (username,), fetch=True)[0][0]
+
+    requests = [Request('daily-reward', 'POST', body={'user_id': user_id}) for _ in range(ctx.requests)]
+    result, samples = ctx.measure(requests)
+
+    final_balance = ctx.sql("SELECT balance + pending_coins(id) FROM users WHERE id = %s", (user_id,), fetch=True)[0][0]
+    successes = sum(1 for s in samples if s.status == 200)
+    result['checks'] = {
+        'successful_claims': successes,
+        'exactly_one_payout': successes == 1 and final_balance == 100
+    }
+    return result
+
+
+def workload_admin_listing(ctx: BenchContext) -> Dict[str, Any]:
+    max_id = ctx.sql("SELECT COALESCE(MAX(id), 0) FROM users", fetch=True)[0][0]
+    requests = []
+    for i in range(ctx.requests):
+        query: Dict[str, Any] = {'admin_username': BENCH_ADMIN, 'limit': 100}
+        kind = i % 4
+        if kind == 1:
+            query['after_id'] = random.randint(0, max_id)
+        elif kind == 2:
+            query['search'] = f'bench_user_{random.randint(1, 99)}'
+        elif kind == 3:
+            query['is_banned'] = 'false'
+            query['after_id'] = random.randint(0, max_id)
+        requests.append(Request('admin', 'GET', query=query, expected_status=200))
+    result, _ = ctx.measure(requests)
+    return result
+
+
+def workload_leaderboard_rank(ctx: BenchContext) -> Dict[str, Any]:
+    ctx.sql("""UPDATE users SET balance = (random() * 1000000)::int
+               WHERE username LIKE 'bench\\_user\\_%' AND balance = 1000""")
+    ids = [row[0] for row in ctx.sql("SELECT id FROM users WHERE username LIKE 'bench\\_user\\_%'", fetch=True)]
+    requests = [Request('leaderboard', 'GET', query={'limit': 10, 'user_id': random.choice(ids)}, expected_status=200)
+                for _ in range(ctx.requests)]
+    result, _ = ctx.measure(requests)
+    return result
+
+
+WORKLOADS: Dict[str, Callable[[BenchContext], Dict[str, Any]]] = {
+    'scenarios': workload_scenarios,
+    'login_storm': workload_login_storm,
+    'purchase_race': workload_purchase_race,
+    'daily_claim_spike': workload_daily_claim_spike,
+    'admin_listing': workload_admin_listing,
+    'leaderboard_rank': workload_leaderboard_rank
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=BACKEND_DIR.parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    lines = []
+    for workload, result in current['workloads'].items():
+        before = previous.get('workloads', {}).get(workload, {}).get('handlers', {})
+        for function, stats in result.get('handlers', {}).items():
+            old = before.get(function)
+            if not old:
+                continue
+            parts = []
+            for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+                if old.get(metric) and stats.get(metric) is not None:
+                    change = 100 * (stats[metric] - old[metric]) / old[metric]
+                    parts.append(f'{metric} {old[metric]} -> {stats[metric]} ({change:+.1f}%)')
+            lines.append(f'{workload}/{function}: ' + ', '.join(parts))
+    if previous.get('cold_start') and current.get('cold_start'):
+        lines.extend(coldstart.compare(previous, current['cold_start']))
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='requests per workload')
+    parser.add_argument('--seed-users', type=int, default=1000)
+    parser.add_argument('--base-url', help='benchmark a running gateway instead of an in-process one')
+    parser.add_argument('--cold', action='store_true', help='in-process only: fresh function instance per request')
+    parser.add_argument('--cold-start', action='store_true',
+                        help='also profile a cold start of every function in a fresh process')
+    parser.add_argument('--cold-start-runs', type=int, default=3, help='fresh processes per function')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--output', help='results file (default bench_results/<timestamp>-<commit>.json)')
+    args = parser.parse_args()
+
+    names = args.workloads.split(',')
+    unknown = [n for n in names if n not in WORKLOADS]
+    if unknown:
+        parser.error(f'unknown workloads: {", ".join(unknown)}')
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    seed(conn, args.seed_users)
+
+    client = HttpClient(args.base_url) if args.base_url else InProcessClient(Gateway(cold=args.cold))
+    ctx = BenchContext(client, conn, args.concurrency, args.requests, args.seed_users)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'seed_users': args.seed_users,
+            'mode': 'http' if args.base_url else ('in-process cold' if args.cold else 'in-process warm')
+        },
+        'workloads': {}
+    }
+    for name in names:
+        print(f'running {name}...', flush=True)
+        results['workloads'][name] = WORKLOADS[name](ctx)
+        for function, stats in results['workloads'][name]['handlers'].items():
+            print(f'  {function}: {stats["throughput_rps"]} rps, p50 {stats["p50_ms"]} ms, '
+                  f'p95 {stats["p95_ms"]} ms, p99 {stats["p99_ms"]} ms, '
+                  f'queries/req {stats["queries_per_request"]}, statuses {stats["statuses"]}')
+        if 'checks' in results['workloads'][name]:
+            print(f'  checks: {results["workloads"][name]["checks"]}')
+    conn.close()
+
+    if args.cold_start:
+        print('profiling cold starts...', flush=True)
+        results['cold_start'] = coldstart.profile(runs=args.cold_start_runs)
+        for line in coldstart.describe(results['cold_start']):
+            print(f'  {line}')
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f'{time.strftime("%Y%m%d-%H%M%S")}-{results["meta"]["commit"]}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print(f'results written to {output}')
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        for line in compare(previous, results):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+'''
+Cold-start profiler for the backend functions. Each function is started in a
+fresh interpreter (python -B -X importtime) that imports its index.py and then
+handles the first scenario of its tests.json once. Per function it reports:
+
+    process_ms         interpreter start to exit, as seen from outside
+    import_ms          importing index.py and everything it pulls in
+    first_query_ms     time into the first invocation until its first query
+                       finished (first_query_ms of the timing.py log line)
+    first_response_ms  import_ms plus the first invocation
+    modules            cumulative import time of each module index.py imports
+
+Figures are medians over --runs fresh processes. No bytecode is written, so
+every run compiles the function's own modules like a freshly deployed instance.
+
+Usage:
+    DATABASE_URL=postgresql://... python tools/coldstart.py
+    python tools/coldstart.py --functions auth,gifts --runs 5 --output cold.json
+    python tools/coldstart.py --compare cold-before.json
+'''
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from gateway import discover_functions, build_event  # noqa: E402
+
+IMPORT_MARK = 'coldstart: import'
+INVOKE_MARK = 'coldstart: invoke'
+METRICS = ('process_ms', 'import_ms', 'first_query_ms', 'first_response_ms')
+
+# Runs in the fresh interpreter. Only sys and time are imported before index,
+# so modules shared with the handler are charged to the handler.
+CHILD_SOURCE = f'''
+import sys, time
+fn_dir, name, event_json = sys.argv[1:4]
+sys.path.insert(0, fn_dir)
+sys.stderr.write({IMPORT_MARK!r} + '\\n')
+started = time.perf_counter()
+import index
+import_seconds = time.perf_counter() - started
+sys.stderr.write({INVOKE_MARK!r} + '\\n')
+
+import contextlib, io, json, types
+event = json.loads(event_json)
+context = types.SimpleNamespace(request_id='coldstart', function_name=name)
+log = io.StringIO()
+status, error = None, None
+started = time.perf_counter()
+try:
+    with contextlib.redirect_stdout(log):
+        status = index.handler(event, context).get('statusCode')
+except Exception as exc:
+    error = f'{{type(exc).__name__}}: {{exc}}'
+handler_seconds = time.perf_counter() - started
+
+first_query_ms = None
+for line in log.getvalue().splitlines():
+    try:
+        record = json.loads(line)
+    except ValueError:
+        continue
+    if isinstance(record, dict) and record.get('type') == 'timing':
+        first_query_ms = record.get('first_query_ms')
+print(json.dumps({{
+    'import_ms': round(import_seconds * 1000, 3),
+    'handler_ms': round(handler_seconds * 1000, 3),
+    'first_query_ms': first_query_ms,
+    'status': status,
+    'error': error
+}}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def first_event(index_path: Path) -> Dict[str, Any]:
+    '''
+    Event for the first tests.json scenario of the function, or a bare GET
+    when it has none
+    '''
+    tests_path = index_path.parent / 'tests.json'
+    tests = json.loads(tests_path.read_text(encoding='utf-8')).get('tests', []) if tests_path.exists() else []
+    test = tests[0] if tests else {'method': 'GET', 'path': '/'}
+    parts = urlsplit(test.get('path', '/'))
+    body = json.dumps(test['body']).encode('utf-8') if test.get('body') is not None else b''
+    return build_event(test['method'], parts.path, parts.query, {'Content-Type': 'application/json'}, body, '127.0.0.1')
+
+
+def module_times(stderr: str) -> Dict[str, float]:
+    '''
+    Cumulative milliseconds of every module imported directly by index.py,
+    from the -X importtime lines between the two markers
+    '''
+    lines = stderr.split(IMPORT_MARK, 1)[-1].split(INVOKE_MARK, 1)[0].splitlines()
+    result = {}
+    for line in lines:
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 2:
+            result[match.group(4)] = round(int(match.group(2)) / 1000, 3)
+    return result
+
+
+def profile_once(name: str, index_path: Path, event: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-B', '-X', 'importtime', '-c', CHILD_SOURCE, str(index_path.parent), name,
+         json.dumps(event)],
+        capture_output=True, text=True
+    )
+    process_ms = round((time.perf_counter() - started) * 1000, 3)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        return {'process_ms': process_ms, 'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'no output'}
+    child = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {
+        'process_ms': process_ms,
+        'import_ms': child['import_ms'],
+        'first_query_ms': child['first_query_ms'],
+        'first_response_ms': round(child['import_ms'] + child['handler_ms'], 3),
+        'status': child['status'],
+        'error': child['error'],
+        'modules': module_times(proc.stderr)
+    }
+
+
+def median(values: List[Optional[float]]) -> Optional[float]:
+    present = [v for v in values if v is not None]
+    return round(statistics.median(present), 3) if present else None
+
+
+def profile(functions: Optional[List[str]] = None, runs: int = 3) -> Dict[str, Dict[str, Any]]:
+    found = discover_functions()
+    names = functions or list(found)
+    unknown = [n for n in names if n not in found]
+    if unknown:
+        raise ValueError(f'Unknown functions: {", ".join(unknown)}')
+
+    result = {}
+    for name in names:
+        event = first_event(found[name])
+        samples = [profile_once(name, found[name], {**event, 'requestContext': {
+            **event['requestContext'], 'requestId': uuid.uuid4().hex}}) for _ in range(max(1, runs))]
+        summary: Dict[str, Any] = {metric: median([s.get(metric) for s in samples]) for metric in METRICS}
+        summary['status'] = samples[-1].get('status')
+        summary['error'] = samples[-1].get('error')
+        modules = {m for s in samples for m in s.get('modules', {})}
+        summary['modules'] = dict(sorted(
+            ((m, median([s.get('modules', {}).get(m) for s in samples])) for m in modules),
+            key=lambda item: -(item[1] or 0)
+        ))
+        result[name] = summary
+    return result
+
+
+def describe(result: Dict[str, Dict[str, Any]], top: int = 5) -> List[str]:
+    lines = []
+    for name, stats in result.items():
+        figures = ', '.join(f'{metric} {stats[metric]}' for metric in METRICS if stats.get(metric) is not None)
+        lines.append(f'{name}: {figures}, status {stats.get("status")}'
+                     + (f' ({stats["error"]})' if stats.get('error') else ''))
+        slowest = list(stats.get('modules', {}).items())[:top]
+        if slowest:
+            lines.append('  slowest imports: ' + ', '.join(f'{m} {ms} ms' for m, ms in slowest))
+    return lines
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Dict[str, Any]]) -> List[str]:
+    '''
+    Before/after lines for each function. previous is either an earlier
+    profile or a bench.py results file that contains one under "cold_start".
+    '''
+    before_all = previous.get('cold_start', previous)
+    lines = []
+    for name, stats in current.items():
+        old = before_all.get(name)
+        if not isinstance(old, dict):
+            continue
+        parts = []
+        for metric in METRICS:
+            if old.get(metric) and stats.get(metric) is not None:
+                change = 100 * (stats[metric] - old[metric]) / old[metric]
+                parts.append(f'{metric} {old[metric]} -> {stats[metric]} ({change:+.1f}%)')
+        if parts:
+            lines.append(f'cold_start/{name}: ' + ', '.join(parts))
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', help='comma-separated subset of functions to profile')
+    parser.add_argument('--runs', type=int, default=3, help='fresh processes per function')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to print per function')
+    parser.add_argument('--output', help='write the profile as JSON to this file')
+    parser.add_argument('--compare', help='earlier profile (or bench.py results file) to compare against')
+    args = parser.parse_args()
+
+    try:
+        result = profile(args.functions.split(',') if args.functions else None, args.runs)
+    except ValueError as exc:
+        parser.error(str(exc))
+    for line in describe(result, args.top):
+        print(line)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+        print(f'profile written to {args.output}')
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        for line in compare(previous, result):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+'''
+Local HTTP gateway for the cloud functions in backend/. Each backend/<name>/index.py
+is loaded as its own isolated instance and served at http://host:port/<name>/...,
+with requests translated into the event shape the platform passes to handler().
+
+Usage:
+    DATABASE_URL=postgresql://... python tools/gateway.py --port 8000 --workers 16
+    python tools/gateway.py --cold            # fresh instance for every request
+    python tools/gateway.py --recycle-after 500
+
+GET /_gateway/stats returns per-function request, cold start and pool counters,
+how reads were routed when DATABASE_READ_URL is set, and per-statement call
+counts and time of the prepared-statement registry.
+'''
+import argparse
+import base64
+import importlib.util
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+_load_lock = threading.Lock()
+
+
+def discover_functions(backend_dir: Path = BACKEND_DIR) -> Dict[str, Path]:
+    return {p.parent.name: p for p in sorted(backend_dir.glob('*/index.py'))}
+
+
+def load_instance(name: str, index_path: Path) -> ModuleType:
+    '''
+    Imports index.py together with its sibling modules (db.py, tokens.py, ...)
+    without leaking them into sys.modules, so every function and every cold
+    instance gets its own copy of module-level state such as the pool.
+    '''
+    fn_dir = str(index_path.parent)
+    local_names = {p.stem for p in index_path.parent.glob('*.py')}
+    with _load_lock:
+        saved = {n: sys.modules.pop(n) for n in local_names if n in sys.modules}
+        sys.path.insert(0, fn_dir)
+        try:
+            spec = importlib.util.spec_from_file_location(f'fn_{name.replace("-", "_")}_{uuid.uuid4().hex}', index_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(fn_dir)
+            for n in local_names:
+                sys.modules.pop(n, None)
+            sys.modules.update(saved)
+    return module
+
+
+def instance_pools(module: ModuleType) -> Tuple[Any, Any]:
+    '''
+    Returns the instance's primary pool and read router, either may be None
+    '''
+    router = module.get_read_pool() if hasattr(module, 'get_read_pool') else None
+    if router is not None:
+        return router.primary, router
+    return (module.get_pool() if hasattr(module, 'get_pool') else None), None
+
+
+def shutdown_instance(module: ModuleType) -> None:
+    try:
+        primary, router = instance_pools(module)
+        if router is not None:
+            router.closeall()
+        if primary is not None:
+            primary.closeall()
+    except Exception:
+        pass
+
+
+class FunctionHost:
+    '''
+    Serves one function. Warm mode keeps a single instance and reuses it for
+    every request; cold mode loads a fresh instance per request; recycle_after
+    replaces the warm instance after that many requests.
+    '''
+
+    def __init__(self, name: str, index_path: Path, cold: bool = False, recycle_after: int = 0):
+        self.name = name
+        self.index_path = index_path
+        self.cold = cold
+        self.recycle_after = recycle_after
+        self._lock = threading.Lock()
+        self._instance: Optional[ModuleType] = None
+        self._served_by_instance = 0
+        self.requests = 0
+        self.errors = 0
+        self.cold_starts = 0
+        self.cold_start_seconds = 0.0
+
+    def _new_instance(self) -> ModuleType:
+        started = time.perf_counter()
+        module = load_instance(self.name, self.index_path)
+        with self._lock:
+            self.cold_starts += 1
+            self.cold_start_seconds += time.perf_counter() - started
+        return module
+
+    def _acquire(self) -> ModuleType:
+        if self.cold:
+            return self._new_instance()
+        with self._lock:
+            instance = self._instance
+            if instance is not None and self.recycle_after and self._served_by_instance >= self.recycle_after:
+                retired, self._instance, instance = instance, None, None
+                threading.Thread(target=shutdown_instance, args=(retired,), daemon=True).start()
+            if instance is not None:
+                self._served_by_instance += 1
+                return instance
+        instance = self._new_instance()
+        with self._lock:
+            if self._instance is None:
+                self._instance = instance
+                self._served_by_instance = 0
+            else:
+                shutdown_instance(instance)
+                instance = self._instance
+            self._served_by_instance += 1
+        return instance
+
+    def invoke(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        instance = self._acquire()
+        context = SimpleNamespace(request_id=uuid.uuid4().hex, function_name=self.name)
+        try:
+            return instance.handler(event, context)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.requests += 1
+            if self.cold:
+                shutdown_instance(instance)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'cold_starts': self.cold_starts,
+                'cold_start_ms_avg': round(1000 * self.cold_start_seconds / self.cold_starts, 2) if self.cold_starts else None
+            }
+            instance = self._instance
+        if instance is not None:
+            try:
+                primary, router = instance_pools(instance)
+            except KeyError:
+                primary, router = None, None
+            if primary is not None:
+                result['pool'] = primary.stats()
+            if router is not None:
+                result['reads'] = router.stats()
+            if hasattr(instance, 'statements'):
+                result['statements'] = instance.statements.stats()
+        return result
+
+
+class Gateway:
+    def __init__(self, functions: Optional[List[str]] = None, cold: bool = False, recycle_after: int = 0):
+        found = discover_functions()
+        names = functions or list(found)
+        unknown = [n for n in names if n not in found]
+        if unknown:
+            raise ValueError(f'Unknown functions: {", ".join(unknown)}')
+        self.hosts = {n: FunctionHost(n, found[n], cold=cold, recycle_after=recycle_after) for n in names}
+
+    def invoke(self, name: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        return self.hosts[name].invoke(event)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: host.stats() for name, host in self.hosts.items()}
+
+
+def build_event(method: str, path: str, query: str, headers: Dict[str, str], body: bytes,
+                source_ip: str) -> Dict[str, Any]:
+    try:
+        text_body, is_base64 = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text_body, is_base64 = base64.b64encode(body).decode('ascii'), True
+    return {
+        'httpMethod': method,
+        'path': path or '/',
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)),
+        'body': text_body,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'requestId': uuid.uuid4().hex,
+            'identity': {'sourceIp': source_ip}
+        }
+    }
+
+
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    gateway: Gateway = None
+    quiet = False
+
+    def _dispatch(self) -> None:
+        url = urlsplit(self.path)
+        parts = url.path.lstrip('/').split('/', 1)
+        name, rest = parts[0], '/' + (parts[1] if len(parts) > 1 else '')
+
+        if name == '_gateway' and rest == '/stats':
+            self._send(200, {'Content-Type': 'application/json'}, json.dumps(self.gateway.stats()).encode('utf-8'))
+            return
+        if name not in self.gateway.hosts:
+            self._send(404, {'Content-Type': 'application/json'}, b'{"error": "Unknown function"}')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        forwarded = self.headers.get('X-Forwarded-For')
+        client_ip = forwarded.split(',')[0].strip() if forwarded else self.client_address[0]
+        event = build_event(self.command, rest, url.query, dict(self.headers.items()), body, client_ip)
+
+        try:
+            response = self.gateway.invoke(name, event)
+        except Exception as exc:
+            self._send(502, {'Content-Type': 'application/json'},
+                       json.dumps({'error': f'{type(exc).__name__}: {exc}'}).encode('utf-8'))
+            return
+
+        payload = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            raw = base64.b64decode(payload)
+        else:
+            raw = payload.encode('utf-8') if isinstance(payload, str) else payload
+        self._send(response.get('statusCode', 200), response.get('headers') or {}, raw)
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes) -> None:
+        self.send_response(status)
+        for key, value in headers.items():
+            if key.lower() != 'content-length':
+                self.send_header(key, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = _dispatch
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    '''
+    HTTPServer that handles connections on a fixed-size thread pool instead
+    of one thread per connection
+    '''
+    daemon_threads = True
+
+    def __init__(self, address: Any, handler_cls: Any, workers: int):
+        super().__init__(address, handler_cls)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gateway')
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def serve(host: str, port: int, workers: int, gateway: Gateway, quiet: bool = False) -> PooledHTTPServer:
+    handler_cls = type('BoundGatewayRequestHandler', (GatewayRequestHandler,), {'gateway': gateway, 'quiet': quiet})
+    return PooledHTTPServer((host, port), handler_cls, workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=16, help='size of the request worker pool')
+    parser.add_argument('--functions', help='comma-separated subset of functions to serve')
+    parser.add_argument('--cold', action='store_true', help='load a fresh instance for every request')
+    parser.add_argument('--recycle-after', type=int, default=0,
+                        help='replace a warm instance after this many requests (0 = never)')
+    parser.add_argument('--quiet', action='store_true', help='do not log every request')
+    args = parser.parse_args()
+
+    gateway = Gateway(args.functions.split(',') if args.functions else None,
+                      cold=args.cold, recycle_after=args.recycle_after)
+    server = serve(args.host, args.port, args.workers, gateway, quiet=args.quiet)
+    print(f'Serving {", ".join(gateway.hosts)} on http://{args.host}:{args.port}/<function>/ '
+          f'({args.workers} workers, {"cold" if args.cold else "warm"} instances)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
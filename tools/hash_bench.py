@@ -0,0 +1,64 @@
+'''
+Micro-benchmark of the auth password hashing. Reports bcrypt hashes per second
+per core for a range of costs, the cost that calibration picks for
+BCRYPT_TARGET_MS on this machine and, with --processes, the aggregate rate
+when every core hashes at once.
+
+Usage:
+    python tools/hash_bench.py
+    python tools/hash_bench.py --rounds 10,11,12 --seconds 3 --processes 4
+'''
+import argparse
+import json
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend' / 'auth'))
+import bcrypt  # noqa: E402
+import passwords  # noqa: E402
+
+
+def hashes_per_second(rounds: int, seconds: float) -> float:
+    salt = bcrypt.gensalt(rounds)
+    count = 0
+    started = time.perf_counter()
+    while True:
+        bcrypt.hashpw(b'benchmark-password', salt)
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def _worker(args: List) -> float:
+    return hashes_per_second(*args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', default='8,10,11,12,13')
+    parser.add_argument('--seconds', type=float, default=2.0, help='measuring time per cost')
+    parser.add_argument('--processes', type=int, default=1, help='hash on this many cores in parallel')
+    parser.add_argument('--target-ms', type=float, default=passwords.BCRYPT_TARGET_MS)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for rounds in (int(r) for r in args.rounds.split(',')):
+        per_core = hashes_per_second(rounds, args.seconds)
+        entry = {'hashes_per_second_per_core': round(per_core, 2), 'ms_per_hash': round(1000 / per_core, 2)}
+        if args.processes > 1:
+            with Pool(args.processes) as pool:
+                rates = pool.map(_worker, [(rounds, args.seconds)] * args.processes)
+            entry['hashes_per_second_total'] = round(sum(rates), 2)
+        results[str(rounds)] = entry
+        print(f'cost {rounds}: {entry}', flush=True)
+
+    calibrated = passwords.calibrate(args.target_ms)
+    print(json.dumps({'target_ms': args.target_ms, 'calibrated_rounds': calibrated, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()